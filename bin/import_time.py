@@ -0,0 +1,30 @@
+#!/usr/bin/python
+
+# Time how long it takes to import modules, each in a fresh interpreter so
+# nothing is already loaded.  Run with topicmod on the PYTHONPATH, e.g.
+#   python bin/import_time.py topicmod.corpora.corpus_reader topicmod.ling.tokens
+
+import sys
+from subprocess import Popen, PIPE
+
+DEFAULT_MODULES = ["topicmod.corpora.corpus_reader", "topicmod.ling.tokens",
+                   "topicmod.ling.texttile_wrapper", "topicmod.util.sets"]
+
+TIMER = "import time; start = time.time(); import %s; " + \
+    "print time.time() - start"
+
+if __name__ == "__main__":
+    modules = sys.argv[1:] or DEFAULT_MODULES
+    repeats = 3
+
+    for ii in modules:
+        times = []
+        for jj in xrange(repeats):
+            p = Popen([sys.executable, "-c", TIMER % ii], stdout=PIPE)
+            output = p.communicate()[0].split()
+            if p.returncode != 0 or not output:
+                print("%s\tfailed to import" % ii)
+                break
+            times.append(float(output[-1]))
+        if times:
+            print("%0.3f\t%s" % (min(times), ii))
@@ -1,4 +1,5 @@
 from topicmod.corpora.proto.corpus_pb2 import Corpus
+from topicmod.corpora.proto_corpus import read_vocab
 from topicmod.util import flags
 
 flags.define_glob("corpus_parts", None, "Where we look for vocab")
@@ -11,8 +12,7 @@ if __name__ == "__main__":
 
     for ii in flags.corpus_parts:
         print ii
-        cp = Corpus()
-        cp.ParseFromString(open(ii, 'r').read())
+        cp = read_vocab(ii)
 
         for ii in cp.authors.terms:
             if ii.id in mapping:
@@ -0,0 +1,12 @@
+from topicmod.util import flags
+from topicmod.corpora.ml_vocab import compile_vocab
+
+flags.define_string("vocab", None, "Vocab file to compile")
+flags.define_string("output", None,
+                    "Where we write the compiled vocab (defaults to "
+                    "vocab.cvocab, where it is found automatically)")
+
+if __name__ == "__main__":
+  flags.InitFlags()
+
+  compile_vocab(flags.vocab, flags.output)
@@ -34,6 +34,54 @@ void ReadVocab(const string& filename, vector< vector<string> >* vocab) {
   assert(nwords > 0);
 }
 
+string PackedFilename(const string& index_filename) {
+  const string extension = ".index";
+  string base = index_filename;
+  if (base.size() > extension.size() &&
+      base.compare(base.size() - extension.size(), extension.size(),
+                   extension) == 0)
+    base = base.substr(0, base.size() - extension.size());
+  return base + ".pack";
+}
+
+bool ReadPackedDocument(std::istream* input, proto_doc* doc) {
+  unsigned char header[4];
+  if (!input->read(reinterpret_cast<char*>(header), 4)) return false;
+  uint32_t length = static_cast<uint32_t>(header[0]) |
+    (static_cast<uint32_t>(header[1]) << 8) |
+    (static_cast<uint32_t>(header[2]) << 16) |
+    (static_cast<uint32_t>(header[3]) << 24);
+  string buffer(length, '\0');
+  if (length > 0 && !input->read(&buffer[0], length)) return false;
+  return doc->ParseFromString(buffer);
+}
+
+void ResolveSharedVocab(const string& index_filename,
+                        lib_corpora_proto::Corpus* section) {
+  if (!section->has_vocab_filename()) return;
+
+  // Every section of a corpus usually shares the same vocab, so keep the
+  // last one we read around
+  static string last_filename;
+  static lib_corpora_proto::Corpus last_vocab;
+
+  string directory = ".";
+  size_t slash = index_filename.rfind('/');
+  if (slash != string::npos) directory = index_filename.substr(0, slash);
+  string vocab_filename = directory + "/" + section->vocab_filename();
+
+  if (vocab_filename != last_filename) {
+    cout << "Reading shared vocab: " << vocab_filename << endl;
+    fstream input(vocab_filename.c_str(), ios::in | ios::binary);
+    assert(input);
+    last_vocab.Clear();
+    assert(last_vocab.ParseFromIstream(&input));
+    last_filename = vocab_filename;
+  }
+  assert(last_vocab.vocab_version() == section->vocab_version());
+  section->MergeFrom(last_vocab);
+}
+
   /*
    * use_lemma - use lemma information, if available
    * remove_stop - remove stop words
@@ -66,6 +114,7 @@ void CorpusReader::ReadProtobuf(const string& location, const string& filename,
   assert(input);
   lib_corpora_proto::Corpus raw_corpus;
   assert(raw_corpus.ParseFromIstream(&input));
+  ResolveSharedVocab(combined, &raw_corpus);
 
   // Create a vocab mapping
   vector<IntIntMap> vocab_mapping;
@@ -82,15 +131,27 @@ void CorpusReader::ReadProtobuf(const string& location, const string& filename,
   vector< set<int> > valid_pos;
   FindValidPos(raw_corpus, pos, &valid_pos);
 
+  // If the section is packed, all of the documents are in one file
+  std::ifstream packed(PackedFilename(combined).c_str(),
+                       ios::in | ios::binary);
+  bool is_packed = packed.is_open();
+  if (is_packed) cout << "Reading packed documents" << endl;
+
   proto_doc doc;
   int docs_added = 0;
   int docs_ignored = 0;
   // For each document, open the file and read in the protocol buffer
   for (int dd = 0; dd < raw_corpus.doc_filenames_size(); ++dd) {
     const string doc_filename = raw_corpus.doc_filenames(dd);
-    fstream input((location + "/" + doc_filename).c_str(),
-                  ios::in | ios::binary);
-    if (!doc.ParseFromIstream(&input)) {
+    bool parsed;
+    if (is_packed) {
+      parsed = ReadPackedDocument(&packed, &doc);
+    } else {
+      fstream input((location + "/" + doc_filename).c_str(),
+                    ios::in | ios::binary);
+      parsed = doc.ParseFromIstream(&input);
+    }
+    if (!parsed) {
       cout << "Failed to read doc " << location + "/" + doc_filename << endl;
       break;
     }
@@ -45,6 +45,18 @@ namespace lib_corpora {
 
 void ReadVocab(const string& filename, vector< vector<string> >* vocab);
 
+// Packed sections store every document in one file (index name with .pack
+// instead of .index), each as a little-endian 32-bit length followed by the
+// serialized Document.
+string PackedFilename(const string& index_filename);
+bool ReadPackedDocument(std::istream* input, proto_doc* doc);
+
+// Sections can refer to a shared vocab file (in the same directory as the
+// index) instead of having their own vocabularies; this adds the shared
+// vocabularies to the section.  Sections with their own are left alone.
+void ResolveSharedVocab(const string& index_filename,
+                        lib_corpora_proto::Corpus* section);
+
 class CorpusReader {
  public:
   CorpusReader(bool use_lemma, bool use_bigram, bool remove_stop,
@@ -4,6 +4,7 @@ from topicmod.corpora.proto.corpus_pb2 import *
 from topicmod.corpora.proto.wordnet_file_pb2 import *
 from topicmod.corpora.ml_vocab import Vocab
 from topicmod.corpora.ml_vocab import MultilingualVocab
+from topicmod.corpora.proto_corpus import read_vocab
 
 import codecs
 
@@ -64,9 +65,7 @@ if __name__ == "__main__":
   superset_vocab = MultilingualVocab()
   for root in flags.doc_roots:
     print "Reading root", root
-    corpus = Corpus()
-    f = open(root, "rb")
-    corpus.ParseFromString(f.read())
+    corpus = read_vocab(root)
 
     for ii in corpus.tokens:
       for jj in ii.terms:
@@ -0,0 +1,13 @@
+from topicmod.util import flags
+from topicmod.corpora.token_matrix import export_token_matrix
+
+flags.define_string("corpus", None, "Corpus directory with the .index files")
+flags.define_string("output", None,
+                    "Base filename of the token matrix (.tokens, .tfidf, "
+                    ".offsets, .doc_ids and .langs are added)")
+
+if __name__ == "__main__":
+  flags.InitFlags()
+
+  num_docs = export_token_matrix(flags.corpus, flags.output)
+  print "Wrote", num_docs, "documents to", flags.output
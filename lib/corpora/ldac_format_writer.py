@@ -3,6 +3,8 @@ from topicmod.util import flags
 from topicmod.util.sets import count_line
 from topicmod.corpora.proto.corpus_pb2 import *
 from topicmod.corpora.proto.wordnet_file_pb2 import *
+from topicmod.corpora.proto_corpus import read_section, read_vocab, \
+    section_documents
 from topicmod.corpora.ml_vocab import MultilingualVocab
 from topicmod.corpora.ml_vocab import Vocab
 
@@ -20,12 +22,9 @@ flags.define_string("language", "en", "What language this is")
 kLANGUAGE_ID = {"en": ENGLISH, "de": GERMAN, "zh": CHINESE}
 
 
-def lda_line(filename, full_vocab, filtered_vocab):
+def lda_line(doc, full_vocab, filtered_vocab):
   d = defaultdict(int)
 
-  doc = Document()
-  doc.ParseFromString(open(filename, 'rb').read())
-
   num_words = 0
   for sent in doc.sentences:
     for word in sent.words:
@@ -51,21 +50,18 @@ if __name__ == "__main__":
   filter_vocab = Vocab(flags.vocab, kLANGUAGE_ID[flags.language])
   for root in flags.doc_roots:
     print "Reading root", root
-    corpus = Corpus()
-    f = open(root, "rb")
-    corpus.ParseFromString(f.read())
+    corpus = read_section(root)
 
     # This allows possibly inconsistent ways of assigning numbers of words, but
     # the final voc should make them consistent
     superset_vocab = MultilingualVocab()
-    for ii in corpus.tokens:
+    for ii in read_vocab(root, corpus).tokens:
       for jj in ii.terms:
         # print ii.language, jj.id, jj.original
         superset_vocab.set(ii.language, jj.id, jj.original)
 
-    for ii in corpus.doc_filenames:
-        rating, line, title, num_words = lda_line(flags.location + ii, \
-                                                    superset_vocab, \
+    for ii, doc in section_documents(flags.location, root, corpus):
+        rating, line, title, num_words = lda_line(doc, superset_vocab, \
                                                     filter_vocab)
         if num_words >= flags.min_length:
           num_docs += 1
@@ -224,7 +224,7 @@ def filterDictionary(d, filter):
 
       # Go through every word
       base_lang = list(langs)[0]
-      for ii in filter._reverse[base_lang]:
+      for ii in filter.words(base_lang):
         # Add a word if it's in every vocab and hasn't been added to mapping
         if all(filter.get_id(x, ii) != -1 for x in langs) and \
               not any(ii in words_seen[x] for x in langs):
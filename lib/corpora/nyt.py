@@ -6,10 +6,31 @@ flags.define_string("nyt_base", "../../data/new_york_times/",
 flags.define_int("doc_limit", -1, "How many documents")
 flags.define_string("output", "/tmp/jbg/nyt/", "Where we write data")
 flags.define_float("bigram_limit", 0.9, "p-value for bigrams")
+flags.define_int("bigram_sketch", 0,
+                 "Width of the sketch for approximate bigram counts (0 for "
+                 "exact counts)")
+flags.define_int("num_workers", 1, "Processes used to write documents")
+flags.define_bool("packed", False, "Pack each section into a single file")
+flags.define_bool("cache_tokens", False,
+                  "Save tokens from the vocab pass for the write pass")
+flags.define_int("prefetch", 0,
+                 "Files to read ahead in background threads")
+flags.define_int("sample", -1,
+                 "Only use a random sample of this many documents per language")
+flags.define_int("sample_seed", 0, "Random seed for the sample")
+flags.define_bool("shared_vocab", False,
+                  "Write the vocab once rather than into every section")
+flags.define_bool("append", False,
+                  "Only add files that aren't already in the corpus")
 
 if __name__ == "__main__":
   flags.InitFlags()
-  nyt = NewYorkTimesReader(flags.nyt_base, flags.doc_limit, flags.bigram_limit)
+  nyt = NewYorkTimesReader(flags.nyt_base, flags.doc_limit, flags.bigram_limit,
+                           cache_tokens=flags.cache_tokens,
+                           prefetch_files=flags.prefetch,
+                           bigram_sketch=flags.bigram_sketch)
   nyt.add_language_list("../../data/new_york_times/editorial_file_list")
+  nyt.set_sample(flags.sample, flags.sample_seed)
 
-  nyt.write_proto(flags.output + "numeric", "nyt", 1000)
+  nyt.write_proto(flags.output + "numeric", "nyt", 1000, flags.num_workers,
+                  flags.packed, flags.append, flags.shared_vocab)
@@ -0,0 +1,17 @@
+from topicmod.util import flags
+from topicmod.corpora.proto_corpus import corpus_sections, is_packed, \
+    pack_section
+
+flags.define_string("corpus", None, "Corpus directory with the .index files")
+flags.define_bool("remove_docs", False,
+                  "Delete the per-document files once they are packed")
+
+if __name__ == "__main__":
+  flags.InitFlags()
+
+  for ii in sorted(corpus_sections(flags.corpus)):
+    if is_packed(ii):
+      print "Already packed", ii
+      continue
+    num_docs = pack_section(flags.corpus, ii, flags.remove_docs)
+    print "Packed", num_docs, "documents from", ii
@@ -13,6 +13,8 @@ flags.define_list("special_stop", [], "Special stop words")
 flags.define_int("min_length", 3, "Minimum length for tokens")
 flags.define_bool("stem", False, "Stem words")
 flags.define_bool("bigram", False, "Use bigrams")
+flags.define_int("num_workers", 1,
+                 "Processes reading corpus parts (1 reads them in order)")
 
 if __name__ == "__main__":
   flags.InitFlags()
@@ -20,9 +22,15 @@ if __name__ == "__main__":
   assert not (flags.stem and flags.bigram), "Can't use stem and bigram"
 
   v = VocabCompiler()
-  for ii in flags.corpus_parts:
-    print ii
-    v.addVocab(ii, flags.exclude_stop, flags.special_stop, \
-                 flags.exclude_punc, flags.exclude_digits, \
-                 flags.stem, flags.bigram, flags.min_length)
+  if flags.num_workers > 1:
+    v.addVocabParts(flags.corpus_parts, flags.exclude_stop,
+                    flags.special_stop, flags.exclude_punc,
+                    flags.exclude_digits, flags.stem, flags.bigram,
+                    flags.min_length, flags.num_workers)
+  else:
+    for ii in flags.corpus_parts:
+      print ii
+      v.addVocab(ii, flags.exclude_stop, flags.special_stop, \
+                   flags.exclude_punc, flags.exclude_digits, \
+                   flags.stem, flags.bigram, flags.min_length)
   v.writeVocab(flags.output, flags.vocab_limit, flags.min_freq)
@@ -7,12 +7,24 @@ flags.define_string("wackypedia_base", "../../data/wackypedia/compressed/",
 flags.define_string("output", "/tmp/jbg/wackypedia/", "Where we write output")
 flags.define_int("doc_limit", 10, "Max number of docs")
 flags.define_list("langs", ["en"], "Which languages")
+flags.define_int("num_workers", 1, "Processes used to write documents")
+flags.define_bool("packed", False, "Pack each section into a single file")
+flags.define_int("sample", -1,
+                 "Only use a random sample of this many documents per language")
+flags.define_int("sample_seed", 0, "Random seed for the sample")
+flags.define_bool("shared_vocab", False,
+                  "Write the vocab once rather than into every section")
+flags.define_int("prefetch", 0,
+                 "Files to read ahead in background threads")
 
 if __name__ == "__main__":
   flags.InitFlags()
-  wacky = WackyCorpus(flags.wackypedia_base, flags.doc_limit)
+  wacky = WackyCorpus(flags.wackypedia_base, flags.doc_limit,
+                      prefetch_files=flags.prefetch)
   for ii in flags.langs:
     wacky.add_language("wackypedia_%s*.gz" % ii)
+  wacky.set_sample(flags.sample, flags.sample_seed)
 
   wacky.write_proto(flags.output + "numeric",
-                    "wpdia", 10000)
+                    "wpdia", 10000, flags.num_workers, flags.packed,
+                    shared_vocab=flags.shared_vocab)
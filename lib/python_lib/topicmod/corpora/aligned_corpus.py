@@ -38,6 +38,7 @@ class AlignedDocument(DocumentReader):
 
 
 class AlignedCorpus(CorpusReader):
+    one_doc_per_file = True
 
     def paired_iterator(self, lang=ENGLISH):
         """
@@ -65,6 +65,7 @@ class AmazonDocument(DocumentReader):
 
 
 class AmazonCorpus(CorpusReader):
+    one_doc_per_file = True
 
     def doc_factory(self, lang, filename):
         try:
@@ -1,21 +1,32 @@
 # Removing tagging for now
 #from nlp.treetagger import tag_document
 import os
-from collections import defaultdict
+from collections import defaultdict, deque
 from glob import glob
+from itertools import islice
 from math import log
+from hashlib import md5
+from heapq import nsmallest
 
 import codecs
 import random
+from multiprocessing import Pool
 
+import numpy
 import nltk
 from nltk import FreqDist
 from nltk.tokenize import wordpunct_tokenize
 from nltk.tokenize import PunktWordTokenizer
+from nltk.util import ibigrams
 
+from topicmod.ling.resources import punkt
 from topicmod.ling.snowball_wrapper import Snowball
 from topicmod.ling.stop import StopWords
-from topicmod.util.sets import poll_iterator
+from topicmod.util.sets import poll_iterator, read_pickle, write_pickle, \
+    Prefetcher, prefetch_chain
+from topicmod.util.spill import SpillCounter, SpillRecords
+from topicmod.corpora.proto_corpus import PackedSectionWriter, \
+    vocab_filename
 from topicmod.ling.bigram_finder import BigramFinder, iterable_to_bigram, \
     iterable_to_bigram_offset
 
@@ -29,24 +40,91 @@ LANGUAGE_ID = {ENGLISH: "english", GERMAN: "german", CHINESE: "chinese", \
                    FRENCH: "french", SPANISH: "spanish", ARABIC: "arabic", \
                    DIXIE: "english"}
 
-sent_tokenizer = {}
-for ii in LANGUAGE_ID:
-    try:
-        sent_tokenizer[ii] = nltk.data.load('tokenizers/punkt/%s.pickle' % \
-                                                LANGUAGE_ID[ii])
-    except LookupError:
-        print("Error loading sentence tokenizer for %s" % LANGUAGE_ID[ii])
-        None
+# How many chunks of documents serialized_docs keeps queued for each worker
+CHUNKS_PER_WORKER = 4
 
 word_tokenizer = PunktWordTokenizer()
 
 
 def write_proto(filename, proto):
+    write_serialized(filename, proto.SerializeToString())
+
+
+def write_serialized(filename, data):
     f = open(filename, "wb")
-    f.write(proto.SerializeToString())
+    f.write(data)
     f.close()
 
 
+def file_fingerprint(filename):
+    """
+    The size and modification time of a file, used to tell whether a file
+    has changed since it was added to a corpus
+    """
+    stat = os.stat(filename)
+    return stat.st_size, int(stat.st_mtime)
+
+
+def load_wordnet():
+    """
+    NLTK loads WordNet the first time it's used (e.g. by morphy when
+    stemming), and doing that from more than one thread at once can fail, so
+    load it before starting threads that read documents
+    """
+    from nltk.corpus import wordnet
+    try:
+        wordnet.morphy("documents")
+    except LookupError:
+        # Not installed; only a problem for readers that use it
+        pass
+
+
+def sample_key(rand_seed, filename, index):
+    """
+    A random (but reproducible) key for the index-th document of a file.
+    Samples are the documents with the smallest keys.
+    """
+    return int(md5("%i %s %i" % (rand_seed, filename, index)).hexdigest()[:15],
+               16)
+
+
+class FileRead:
+    """
+    Follows the last document of a file in lang_iter's stream of documents,
+    so that only files that were read all the way through are recorded
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+
+
+# The reader whose vocabularies the worker processes use; set in each worker
+# by init_proto_worker (workers are forked, so nothing large is pickled)
+_worker_reader = None
+_worker_bigrams = None
+
+
+def init_proto_worker(reader, bigram_list):
+    global _worker_reader, _worker_bigrams
+    _worker_reader = reader
+    _worker_bigrams = bigram_list
+
+
+def proto_worker(job):
+    """
+    Serialize a single document inside a worker process.  Returns the doc id
+    along with the serialized protocol buffer so the parent can write the
+    documents in their original order.
+    """
+    doc_id, lang, doc = job
+    doc_proto = _worker_reader.doc_proto(doc, doc_id, lang, _worker_bigrams)
+    return doc_id, doc_proto.SerializeToString()
+
+
+def proto_chunk_worker(jobs):
+    return [proto_worker(x) for x in jobs]
+
+
 class DocumentReader:
     """
     Base class that represents a document
@@ -62,11 +140,29 @@ class DocumentReader:
         """
         Returns an iterator over sentences.
         """
-        assert self.lang in sent_tokenizer, "%i lang missing" % self.lang
+        assert self.lang in LANGUAGE_ID, "%i lang missing" % self.lang
 
-        for ii in sent_tokenizer[self.lang].tokenize(self._raw):
+        # Sentence tokenizers are loaded the first time a language is seen
+        for ii in punkt(LANGUAGE_ID[self.lang]).tokenize(self._raw):
             yield word_tokenizer.tokenize(ii)
 
+    def cached_sentences(self):
+        """
+        A list of the document's sentences.  The document is only tokenized
+        the first time this is called (unless the tokens were provided with
+        set_cached_sentences); everything else reuses the tokens.
+        """
+        if getattr(self, "_token_cache", None) is None:
+            self._token_cache = list(self.sentences())
+        return self._token_cache
+
+    def set_cached_sentences(self, sentences):
+        """
+        Provide tokens for the document (e.g. saved from an earlier pass) so
+        that it doesn't need to be tokenized again.
+        """
+        self._token_cache = sentences
+
     def raw(self):
         """
         The raw text of the document
@@ -96,7 +192,7 @@ class DocumentReader:
         d.language = language
 
         tf_token = nltk.FreqDist()
-        for ii in self.sentences():
+        for ii in self.cached_sentences():
             for jj in ii:
                 tf_token.inc(jj)
 
@@ -107,21 +203,25 @@ class DocumentReader:
               bigram_normalize=None):
 
         d, tf = self.prepare_document(num, language, authors)
+        sentences = self.cached_sentences()
+        tfidf = df.sentence_tfidf(sentences, token_vocab)
 
-        for ii in self.sentences():
+        for ii, scores in zip(sentences, tfidf):
             s = d.sentences.add()
 
             s = self.fill_sentence(s, ii, language, token_vocab, lemma_vocab,
                                    pos, synsets, stemmer, bigram_vocab,
-                                   tf, df, bigram_list, bigram_normalize)
+                                   scores, bigram_list, bigram_normalize)
 
         return d
 
     def fill_sentence(self, sentence, sentence_tokens, language,
                       token_vocab, lemma_vocab, pos, synsets, stemmer,
-                      bigram_vocab, tf, df, bigram_list, bigram_normalize):
+                      bigram_vocab, tfidf, bigram_list, bigram_normalize):
         """
         A method to fill a sentence protocol buffer from source tokens.
+        tfidf is the tf-idf of each of the sentence's tokens (from
+        DfCalculator.sentence_tfidf).
         """
         bigrams = defaultdict(str)
         if bigram_list:
@@ -135,7 +235,7 @@ class DocumentReader:
             w = sentence.words.add()
             w.token = token_vocab[ii]
             w.lemma = lemma_vocab[stemmer(language, ii)]
-            w.tfidf = df.compute_tfidf(ii, tf.freq(ii))
+            w.tfidf = tfidf[index]
             if index in bigrams:
                 w.bigram = bigram_vocab[bigrams[index]]
             else:
@@ -155,7 +255,7 @@ class DocumentReader:
         A list of all the tokens in the document
         """
 
-        for ii in self.sentences():
+        for ii in self.cached_sentences():
             for jj in ii:
                 yield jj
 
@@ -167,32 +267,153 @@ class DocumentReader:
 
 
 class DfCalculator:
+    """
+    Document frequencies for a language.  Only an integer count is kept for
+    each word, so word_seen must see all the words of a document before
+    moving on to the next one; a word is counted at most once per document.
+    """
 
     def __init__(self):
-        self._df_counts = defaultdict(set)
-        self._docs = set()
+        self._df_counts = defaultdict(int)
+        self._num_docs = 0
+        self._current_doc = None
+        self._current_words = set()
+
+        # The idf of every term id of a vocab, built by idf_array once the
+        # counts stop changing
+        self._idf = None
+        self._idf_vocab = None
 
     def word_seen(self, doc, word):
-        self._df_counts[word].add(doc)
-        self._docs.add(doc)
+        if doc != self._current_doc:
+            self._current_doc = doc
+            self._current_words = set()
+            self._num_docs += 1
+
+        if not word in self._current_words:
+            self._current_words.add(word)
+            self._df_counts[word] += 1
+            self._idf = None
+
+    def df(self, word):
+        return self._df_counts.get(word, 0)
+
+    def num_docs(self):
+        return self._num_docs
+
+    def counts(self):
+        """
+        The document frequencies and number of documents, e.g. to save in a
+        build manifest
+        """
+        return dict(self._df_counts), self._num_docs
+
+    def add_counts(self, df_counts, num_docs):
+        """
+        Add document frequencies counted elsewhere (e.g. by an earlier build)
+        """
+        for ww in df_counts:
+            self._df_counts[ww] += df_counts[ww]
+        self._num_docs += num_docs
+        self._idf = None
 
     def compute_tfidf(self, word, tf):
-        idf = log(len(self._docs)) - log(len(self._df_counts[word]))
+        idf = log(self._num_docs) - log(self.df(word))
         return tf * idf
 
+    def idf_array(self, token_vocab):
+        """
+        The idf of every term, indexed by its id in token_vocab (a dictionary
+        from word to id).  The array is kept until the counts change, so
+        while a corpus is written out it is only built once.
+        """
+        if self._idf is None or self._idf_vocab is not token_vocab or \
+                len(self._idf) <= max(token_vocab.itervalues()):
+            df = numpy.ones(max(token_vocab.itervalues()) + 1)
+            for ww, ii in token_vocab.iteritems():
+                df[ii] = max(self.df(ww), 1)
+            self._idf = log(self._num_docs) - numpy.log(df)
+            self._idf_vocab = token_vocab
+        return self._idf
+
+    def compute_doc_tfidf(self, token_ids, token_vocab):
+        """
+        Return the tf-idf of every position of a document, given the ids (in
+        token_vocab) of its tokens, as a NumPy array.
+        """
+        token_ids = numpy.asarray(token_ids, dtype=numpy.int64)
+        if len(token_ids) == 0:
+            return numpy.zeros(0)
+        terms, positions = numpy.unique(token_ids, return_inverse=True)
+        tf = numpy.bincount(positions)[positions] / float(len(token_ids))
+        return tf * self.idf_array(token_vocab)[token_ids]
+
+    def sentence_tfidf(self, sentences, token_vocab):
+        """
+        compute_doc_tfidf for a document given as a list of sentences of
+        words; returns a list of the tf-idf of each sentence's tokens
+        """
+        ids = [token_vocab[jj] for ii in sentences for jj in ii]
+        scores = self.compute_doc_tfidf(ids, token_vocab).tolist()
+        result = []
+        start = 0
+        for ii in sentences:
+            result.append(scores[start:start + len(ii)])
+            start += len(ii)
+        return result
+
 
 class CorpusReader:
     """
     A collection of documents
     """
 
-    def __init__(self, base, doc_limit=-1, bigram_limit=-1):
+    # Readers whose files each hold one document should set this so that
+    # sampling doesn't need to open files to know what's in them
+    one_doc_per_file = False
+
+    def __init__(self, base, doc_limit=-1, bigram_limit=-1, spill_dir=None,
+                 max_pairs=2000000, cache_tokens=False, stem_cache=None,
+                 prefetch_files=0, bigram_sketch=0):
         self._file_base = base
         self._files = defaultdict(set)
         self._total_docs = 0
 
         self._bigram_finder = {}
         self._bigram_limit = bigram_limit
+        self._bigram_list = {}
+
+        # If we're appending to a corpus, the bigrams (by language) found when
+        # it was first built; these are used rather than finding new ones
+        self._fixed_bigrams = None
+
+        # Where write_proto picks up numbering documents and sections
+        self._next_doc_id = 0
+        self._next_section = defaultdict(int)
+
+        # Fingerprints (by language) of the files already in the corpus
+        self._built_files = defaultdict(dict)
+
+        # The files (by language) whose documents lang_iter has given out;
+        # with a doc limit or a sample this is only some of self._files
+        self._read_files = defaultdict(set)
+
+        # How many shared vocab files write_proto has written for the corpus
+        self._vocab_version = 0
+
+        # Where (and after how many distinct pairs) bigram statistics are
+        # spilled to disk while building the vocab
+        self._spill_dir = spill_dir
+        self._max_pairs = max_pairs
+
+        # If positive, adjacent pairs are instead counted approximately in a
+        # count-min sketch this wide (see BigramFinder), and nothing spills
+        self._bigram_sketch = bigram_sketch
+
+        # If true, the tokens seen while building the vocab are saved to disk
+        # and given back to the documents when writing them out
+        self._cache_tokens = cache_tokens
+        self._token_spill = None
 
         self._author_freq = FreqDist()
         self._word_df = defaultdict(DfCalculator)
@@ -213,9 +434,25 @@ class CorpusReader:
         self._doc_limit = doc_limit
         self._stemmer = Snowball()
 
+        # The documents (language -> filename -> indices) set_sample chose;
+        # if None, we use every document
+        self._sample = None
+
+        # How many files ahead of the current one lang_iter reads in
+        # background threads (0 to read everything in the main thread)
+        self._prefetch_files = prefetch_files
+
+        # A file of stems saved by an earlier run
+        self._stem_cache = stem_cache
+        if stem_cache and os.path.exists(stem_cache):
+            self._stemmer.load_cache(stem_cache)
+
     def lang_iter(self, lang):
         print "DOC LIMIT %i" % self._doc_limit
         file_list = list(self._files[lang])
+        if self._sample is not None:
+            chosen = self._sample.get(lang, {})
+            file_list = [x for x in file_list if x in chosen]
 
         doc_num = 0
 
@@ -223,20 +460,40 @@ class CorpusReader:
         random.seed(0)
         random.shuffle(file_list)
 
+        # Prefetching reads (and parses) documents in background threads,
+        # but they come out in the same order as without it
+        prefetch = self._prefetch_files > 0
+        if prefetch:
+            load_wordnet()
         if len(file_list) > 100:
-            for ff in file_list:
-                for dd in self.doc_factory(lang, ff):
-                    if self._doc_limit > 0 and doc_num >= self._doc_limit:
-                        return
-                    doc_num += 1
-                    yield dd
+            if prefetch:
+                docs = prefetch_chain((self.marked_file_docs(lang, x) for x in
+                                       file_list), self._prefetch_files)
+            else:
+                docs = (dd for ff in file_list for dd in
+                        self.marked_file_docs(lang, ff))
         else:
-            file_list = list(self.doc_factory(lang, x) for x in file_list)
-            for dd in poll_iterator(file_list):
+            file_list = list(self.marked_file_docs(lang, x) for x in
+                             file_list)
+            # Shuffle as poll_iterator would, but before any thread starts
+            random.shuffle(file_list)
+            docs = poll_iterator(file_list, shuffle=False)
+            if prefetch:
+                # One thread reads ahead of the whole round-robin stream
+                docs = Prefetcher(docs)
+
+        try:
+            for dd in docs:
+                if isinstance(dd, FileRead):
+                    self._read_files[lang].add(dd.filename)
+                    continue
                 if self._doc_limit > 0 and doc_num >= self._doc_limit:
                     return
                 doc_num += 1
                 yield dd
+        finally:
+            if prefetch:
+                docs.close()
 
     def __iter__(self):
         """
@@ -255,15 +512,113 @@ class CorpusReader:
         Iterate over a subset of the documents.  Given the same random
         seed, the results should be consistent.
         """
-        raise NotImplementedError
+        previous = self._sample
+        self.set_sample(num_docs, rand_seed)
+        try:
+            for ii in self:
+                yield ii
+        finally:
+            self._sample = previous
+
+    def set_sample(self, num_docs=-1, rand_seed=0):
+        """
+        From now on (including in write_proto), only use a random sample of
+        num_docs documents from each language (or all of them if num_docs is
+        negative).
+
+        Each document gets a key by hashing its file, position in the file
+        and the seed; the sample is the num_docs documents with the smallest
+        keys.  Finding them only needs doc_keys, which for many formats is
+        much cheaper than reading the documents, and only files with a
+        sampled document are read afterwards.
+        """
+        if num_docs < 0:
+            self._sample = None
+            return
+
+        self._sample = {}
+        for lang in self._files:
+            keys = ((sample_key(rand_seed, self.relative_filename(ff), ii),
+                     ff, ii) for ff in sorted(self._files[lang])
+                    for ii in self.doc_keys(lang, ff))
+            chosen = defaultdict(set)
+            for key, ff, ii in nsmallest(num_docs, keys):
+                chosen[ff].add(ii)
+            print "Sampled", sum(len(x) for x in chosen.values()), \
+                "documents from", len(chosen), "files for language", lang
+            self._sample[lang] = chosen
+
+    def relative_filename(self, filename):
+        """
+        The filename without the base directory, so sample keys don't depend
+        on where the corpus lives
+        """
+        if filename.startswith(self._file_base):
+            return filename[len(self._file_base):]
+        else:
+            return filename
+
+    def doc_keys(self, lang, filename):
+        """
+        The positions of the documents in a file that sampling chooses from.
+        By default, we read the file and count what doc_factory returns;
+        readers can override this (and sampled_doc_factory) to do less work.
+        """
+        if self.one_doc_per_file:
+            return [0]
+        else:
+            return (ii for ii, dd in enumerate(self.doc_factory(lang,
+                                                                filename)))
+
+    def sampled_doc_factory(self, lang, filename, keep):
+        """
+        The documents of a file whose positions (as given by doc_keys) are
+        in keep.
+        """
+        for ii, dd in enumerate(self.doc_factory(lang, filename)):
+            if ii in keep:
+                yield dd
+
+    def file_docs(self, lang, filename):
+        """
+        The documents of a file that we're using
+        """
+        if self._sample is None:
+            return self.doc_factory(lang, filename)
+        else:
+            return self.sampled_doc_factory(lang, filename,
+                                            self._sample[lang][filename])
+
+    def marked_file_docs(self, lang, filename):
+        """
+        The documents of a file followed by a FileRead marker
+        """
+        for dd in self.file_docs(lang, filename):
+            yield dd
+        yield FileRead(filename)
 
     def build_vocab(self):
         """
         Create counts for all of the tokens.  Does care about lemmatization and
         will create separate vocab for that.  Also ignores tags.
+
+        This reads the corpus once.  If we're finding bigrams, candidate
+        bigram counts and the tokenized sentences are collected in the same
+        pass (spilling to disk as needed) so that bigrams can be scored and
+        counted without going back to the raw text.
         """
         self._author_freq = FreqDist()
 
+        find_bigrams = self._bigram_limit > 0
+        count_pairs = find_bigrams and self._fixed_bigrams is None
+        if count_pairs and self._bigram_sketch > 0:
+            pair_counts = {}
+        elif count_pairs:
+            pair_counts = defaultdict(lambda: SpillCounter(self._max_pairs,
+                                                           self._spill_dir))
+        if find_bigrams or self._cache_tokens:
+            sentences = SpillRecords(self._spill_dir)
+
         print "Building vocab:"
         doc = 0
         for ii in self:
@@ -280,7 +635,8 @@ class CorpusReader:
                     self._lemma_freq[ii.lang].inc(jj)
                 except ValueError:
                     None
-            for jj in ii.tokens():
+            tokens = list(ii.tokens())
+            for jj in tokens:
                 try:
                     jj.encode("utf-8", "replace")
                     self._word_freq[ii.lang].inc(jj)
@@ -294,52 +650,92 @@ class CorpusReader:
             for jj in ii.relations():
                 self._tag_freq[ii.lang].inc(jj)
 
+            if count_pairs and self._bigram_sketch > 0:
+                self.bigram_finder(ii.lang).count_adjacent(tokens)
+            elif count_pairs:
+                for jj in ibigrams(tokens):
+                    pair_counts[ii.lang].inc(jj)
+            if find_bigrams or self._cache_tokens:
+                sentences.append((ii.lang, ii.cached_sentences()))
+
         self._total_docs = doc
         self.init_stop()
+        self._stemmer.print_cache_stats()
+
+        if count_pairs:
+            self.count_bigrams(pair_counts, sentences)
+            for ii in pair_counts:
+                pair_counts[ii].close()
+        elif find_bigrams:
+            self.recount_bigrams(self._fixed_bigrams, sentences)
+
+        if self._cache_tokens:
+            if self._token_spill is not None:
+                self._token_spill.close()
+            self._token_spill = sentences
+        elif find_bigrams:
+            sentences.close()
+
+    def count_bigrams(self, pair_counts, sentences):
+        """
+        Given the adjacent token counts and the tokenized sentences collected
+        by build_vocab, find the significant bigrams in each language and
+        count how often they appear.
+        """
+        for ii in self._word_freq:
+            bf = self.bigram_finder(ii)
+            bf.set_counts(self._word_freq[ii])
+            print("Finding bigrams in language %i" % ii)
+            if ii in pair_counts:
+                bf.add_ngram_pair_counts(pair_counts[ii].items())
 
-        if self._bigram_limit > 0:
-            for ii in self._word_freq:
-                bf = BigramFinder(language=LANGUAGE_ID[ii])
-                self._bigram_finder[ii] = bf
-                bf.set_counts(self._word_freq[ii])
-                print("Finding bigrams in language %i" % ii)
+        print("Scoring bigrams")
+        bigrams = {}
 
-            doc = 0
-            for ii in self:
-                lang = ii.language()
-                doc += 1
-                if doc % 100 == 0:
-                    print("Doc %i / %i" % (doc, self._total_docs))
-                self._bigram_finder[lang].add_ngram_counts(ii.tokens())
-
-            print("Scoring bigrams")
-            bigrams = {}
-
-            for lang in self._word_freq:
-                bf = self._bigram_finder[lang]
-                bf.find_ngrams([])
-
-                bigrams[lang] = bf.real_ngrams(self._bigram_limit)
-                print("First 10 bigrams")
-                for ii in bigrams[lang].keys()[:10]:
-                    print("%s_%s" % ii)
-
-            print("Creating new counts after subtracting bigrams")
-            doc = 0
-            for ii in self:
-                doc += 1
-                lang = ii.language()
-                bf = self._bigram_finder[lang]
-                if doc % 100 == 0:
-                    print("Doc %i / %i" % (doc, self._total_docs))
+        for lang in self._word_freq:
+            bf = self._bigram_finder[lang]
+            bf.find_ngrams([])
 
-#                for jj in ii.tokens():
-#                    self._bigram_freq[lang].inc(jj)
+            bigrams[lang] = bf.real_ngrams(self._bigram_limit)
+            print("First 10 bigrams")
+            for ii in bigrams[lang].keys()[:10]:
+                print("%s_%s" % ii)
 
-                for jj in ii.sentences():
-                    for kk in iterable_to_bigram(jj, bigrams[lang],
-                                                 bf.normalize_word):
-                        self._bigram_freq[lang].inc(kk)
+        self.recount_bigrams(bigrams, sentences)
+
+    def bigram_finder(self, lang):
+        """
+        The BigramFinder for a language, created the first time it's needed
+        """
+        if not lang in self._bigram_finder:
+            self._bigram_finder[lang] = \
+                BigramFinder(language=LANGUAGE_ID[lang],
+                             sketch_width=self._bigram_sketch)
+        return self._bigram_finder[lang]
+
+    def recount_bigrams(self, bigrams, sentences):
+        """
+        Count how often the given bigrams (by language) appear in the
+        tokenized sentences collected by build_vocab.
+        """
+        for lang in self._word_freq:
+            self.bigram_finder(lang)
+            if not lang in bigrams:
+                bigrams[lang] = {}
+        self._bigram_list = bigrams
+
+        print("Creating new counts after subtracting bigrams")
+        doc = 0
+        for lang, doc_sentences in sentences:
+            doc += 1
+            bf = self._bigram_finder[lang]
+            if doc % 100 == 0:
+                print("Doc %i / %i" % (doc, self._total_docs))
+
+            for jj in doc_sentences:
+                for kk in iterable_to_bigram(jj, bigrams[lang],
+                                             bf.normalize_word):
+                    self._bigram_freq[lang].inc(kk)
 
     def init_stop(self):
         """
@@ -364,12 +760,22 @@ class CorpusReader:
     def doc_factory(self, lang, filename):
         raise NotImplementedError
 
+    def vocab_order(self, frequency_count, lookup):
+        """
+        The order terms are given ids in: terms that already have an id (from
+        an earlier section or build) keep it, and new terms come after them
+        by frequency.
+        """
+        known = [x for x in frequency_count if x in lookup]
+        known.sort(key=lookup.get)
+        return known + [x for x in frequency_count if not x in lookup]
+
     def fill_proto_vocab(self, frequency_count, vocab_generator, lookup, name):
         for ll in frequency_count:
             voc = vocab_generator()
             voc.language = ll
             word_id = 0
-            for tt in frequency_count[ll]:
+            for tt in self.vocab_order(frequency_count[ll], lookup[ll]):
                 word = voc.terms.add()
                 word.id = word_id
                 word.original = tt
@@ -391,18 +797,19 @@ class CorpusReader:
     def fill_proto_language_independent_vocab(self, frequency_count,
                                               vocab_generator, lookup, name):
         word_id = 0
-        for tt in frequency_count:
+        for tt in self.vocab_order(frequency_count, lookup):
             if not tt:
                 continue
             word = vocab_generator()
-            word.id = word_id
+            word.id = lookup.get(tt, word_id)
             word.original = tt
             word.ascii = tt.encode("ascii", "replace")
             word.frequency = frequency_count[tt]
 
-            lookup[tt] = word_id
+            if not tt in lookup:
+                lookup[tt] = word_id
 
-            word_id += 1
+            word_id = max(word_id, word.id) + 1
 
     def new_section(self):
         """
@@ -429,6 +836,129 @@ class CorpusReader:
 
         return c
 
+    def shared_vocab_section(self, filename, version):
+        """
+        Create a new corpus section that uses a shared vocab file (which
+        new_section must already have filled the lookups for)
+        """
+        c = Corpus()
+        c.vocab_filename = filename
+        c.vocab_version = version
+        return c
+
+    def vocab_counts(self):
+        """
+        The per-language frequency counts and lookups, by name
+        """
+        return {"token": (self._word_freq, self._word_lookup),
+                "bigram": (self._bigram_freq, self._bigram_lookup),
+                "lemma": (self._lemma_freq, self._lemma_lookup),
+                "tag": (self._tag_freq, self._pos_tag_lookup)}
+
+    def save_manifest(self, filename):
+        """
+        Save what's needed to append to the corpus later: fingerprints of the
+        files in it, the vocab lookups and counts, document frequencies,
+        bigrams, and where document and section numbering stopped.
+
+        Only files that were read all the way through are recorded; any that
+        a doc limit stopped before (or that were sampled, and so only partly
+        used) are left for a later append to add.
+        """
+        files = defaultdict(dict)
+        for ll in self._built_files:
+            files[ll].update(self._built_files[ll])
+        for ll in self._files:
+            if self._sample is not None:
+                print "Not recording the files of language", ll, \
+                    "in the manifest: the corpus was sampled"
+                continue
+            for ff in self._read_files[ll]:
+                files[ll][ff] = file_fingerprint(ff)
+            skipped = len(self._files[ll]) - len(self._read_files[ll])
+            if skipped > 0:
+                print "Not recording", skipped, "unread files of language", \
+                    ll, "in the manifest"
+
+        state = {"files": dict(files),
+                 "next_doc_id": self._next_doc_id,
+                 "next_section": dict(self._next_section),
+                 "vocab_version": self._vocab_version,
+                 "df": dict((x, self._word_df[x].counts()) for x in
+                            self._word_df),
+                 "author": (dict(self._author_freq), self._author_lookup),
+                 "synset": (dict(self._synset_freq), self._synset_lookup),
+                 "bigram_list": None}
+        if self._bigram_limit > 0:
+            state["bigram_list"] = self._bigram_list
+
+        vocab = self.vocab_counts()
+        for name in vocab:
+            freq, lookup = vocab[name]
+            state[name] = (dict((x, dict(freq[x])) for x in freq),
+                           dict((x, dict(lookup[x])) for x in lookup))
+
+        write_pickle(state, filename)
+
+    def load_manifest(self, filename):
+        """
+        Load the manifest of an earlier build so that write_proto only adds
+        the files that aren't already in the corpus.  The existing ids of
+        terms and documents are kept, so sections that have already been
+        written stay valid.  Returns the manifest; its counts are added back
+        by add_manifest_counts once the new files have been counted.
+        """
+        state = read_pickle(filename)
+
+        self._built_files = defaultdict(dict, state["files"])
+        self._total_docs = 0
+        for ll in self._files:
+            new_files = set()
+            for ff in self._files[ll]:
+                if not ff in self._built_files[ll]:
+                    new_files.add(ff)
+                elif file_fingerprint(ff) != self._built_files[ll][ff]:
+                    print "Skipping", ff, "which changed after being added"
+            print "Appending", len(new_files), "of", len(self._files[ll]), \
+                "files for language", ll
+            self._files[ll] = new_files
+            self._total_docs += len(new_files)
+
+        self._next_doc_id = state["next_doc_id"]
+        self._next_section = defaultdict(int, state["next_section"])
+        self._vocab_version = state.get("vocab_version", 0)
+        self._fixed_bigrams = state["bigram_list"]
+
+        vocab = self.vocab_counts()
+        for name in vocab:
+            lookup = vocab[name][1]
+            for ll, terms in state[name][1].iteritems():
+                lookup[ll].update(terms)
+        self._author_lookup.update(state["author"][1])
+        self._synset_lookup.update(state["synset"][1])
+
+        return state
+
+    def add_manifest_counts(self, state):
+        """
+        Add the counts saved in a manifest to those from build_vocab.
+        """
+        vocab = self.vocab_counts()
+        for name in vocab:
+            freq = vocab[name][0]
+            for ll, counts in state[name][0].iteritems():
+                for tt, count in counts.iteritems():
+                    freq[ll].inc(tt, count)
+        for tt, count in state["author"][0].iteritems():
+            self._author_freq.inc(tt, count)
+        for tt, count in state["synset"][0].iteritems():
+            self._synset_freq.inc(tt, count)
+        for ll, (df, num_docs) in state["df"].iteritems():
+            self._word_df[ll].add_counts(df, num_docs)
+
+        # Languages that only appear in the earlier build need stop words
+        self.init_stop()
+
     def add_language(self, pattern, language=ENGLISH):
         search = self._file_base + pattern
         print "SEARCH:", search
@@ -436,38 +966,155 @@ class CorpusReader:
             self._files[language].add(ii)
             self._total_docs += 1
 
-    def write_proto(self, path, name, docs_in_sec=10000):
+    def doc_proto(self, doc, doc_id, lang, bigram_list):
+        """
+        Create the protocol buffer for a single document using the vocab
+        built by build_vocab.
+        """
+        if self._bigram_limit > 0:
+            bf = self._bigram_finder[lang]
+            return doc.proto(doc_id, lang, self._author_lookup,
+                             self._word_lookup[lang],
+                             self._word_df[lang],
+                             self._lemma_lookup[lang],
+                             self._pos_tag_lookup[lang],
+                             self._synset_lookup, self._stemmer,
+                             self._bigram_lookup[lang],
+                             bigram_list[lang],
+                             bf.normalize_word)
+        else:
+            return doc.proto(doc_id, lang, self._author_lookup,
+                             self._word_lookup[lang],
+                             self._word_df[lang],
+                             self._lemma_lookup[lang],
+                             self._pos_tag_lookup[lang],
+                             self._synset_lookup, self._stemmer)
+
+    def cached_lang_iter(self, lang, token_records):
+        """
+        Iterate over the documents of a language, giving each the tokens that
+        build_vocab saved for it.  token_records is an iterator over the saved
+        tokens shared across languages (we see languages and documents in the
+        same order as build_vocab did).
+        """
+        for doc in self.lang_iter(lang):
+            doc_lang, sentences = token_records.next()
+            assert doc_lang == lang, "Cached tokens out of sync"
+            doc.set_cached_sentences(sentences)
+            yield doc
+
+    def serialized_docs(self, lang, first_id, bigram_list, num_workers=1,
+                        chunk_size=50, token_records=None):
+        """
+        Iterate over (doc_id, serialized proto) pairs for a language.  Ids are
+        assigned in lang_iter order starting at first_id.  With more than one
+        worker, documents are serialized in a process pool but still come
+        back in lang_iter order, so the output is identical to the serial
+        path.  At most CHUNKS_PER_WORKER chunks of chunk_size documents per
+        worker are read ahead of the one being written, so reading never
+        gets far ahead of serializing.
+        """
+        if token_records is None:
+            docs = self.lang_iter(lang)
+        else:
+            docs = self.cached_lang_iter(lang, token_records)
+        jobs = ((first_id + ii, lang, doc) for ii, doc in enumerate(docs))
+
+        if num_workers <= 1:
+            for doc_id, lang, doc in jobs:
+                yield doc_id, self.doc_proto(doc, doc_id, lang,
+                                             bigram_list).SerializeToString()
+        else:
+            pool = Pool(num_workers, init_proto_worker, (self, bigram_list))
+            pending = deque()
+            try:
+                while True:
+                    while len(pending) < CHUNKS_PER_WORKER * num_workers:
+                        chunk = list(islice(jobs, chunk_size))
+                        if not chunk:
+                            break
+                        pending.append(pool.apply_async(proto_chunk_worker,
+                                                        (chunk,)))
+                    if not pending:
+                        break
+                    for doc_id, data in pending.popleft().get():
+                        yield doc_id, data
+                pool.close()
+            finally:
+                pool.terminate()
+
+    def write_proto(self, path, name, docs_in_sec=10000, num_workers=1,
+                    packed=False, append=False, shared_vocab=False):
+        """
+        Build the vocab and write out the corpus.  If packed is true, the
+        documents of each section are written into one packed file (see
+        proto_corpus) rather than a file per document.  If shared_vocab is
+        true, the vocab is written once (to path/name_version.vocab) and each
+        section refers to it instead of having its own copy.
+
+        A manifest (path/name.manifest) is saved alongside the corpus.  If
+        append is true and the manifest exists, only files that aren't
+        already in the corpus are read; they go into new sections, with
+        document ids continuing from the earlier build.
+        """
+        manifest = "%s/%s.manifest" % (path, name)
+        previous = None
+        if append and os.path.exists(manifest):
+            previous = self.load_manifest(manifest)
+
         self.build_vocab()
-        section = self.new_section()
-        doc_id = 0
+        if previous:
+            self.add_manifest_counts(previous)
+
+        if shared_vocab:
+            self._vocab_version += 1
+            vocab = self.new_section()
+            vocab.vocab_version = self._vocab_version
+            shared_name = vocab_filename(name, self._vocab_version)
+            write_proto("%s/%s" % (path, shared_name), vocab)
+            new_section = lambda: \
+                self.shared_vocab_section(shared_name, self._vocab_version)
+        else:
+            new_section = self.new_section
 
-        bigram_list = {}
-        if self._bigram_limit > 0:
-            for lang in self._bigram_finder:
-                bf = self._bigram_finder[lang]
-                bigram_list[lang] = bf.real_ngrams(self._bigram_limit)
+        section = new_section()
+        doc_id = self._next_doc_id
+
+        bigram_list = self._bigram_list
 
+        token_records = None
+        if self._token_spill is not None:
+            token_records = iter(self._token_spill)
+
+        packer = None
         for lang in self._files:
             doc_num = 0
-            section_num = 0
+            section_num = self._next_section[lang]
 
             filename = "%s/%s_%s_%i" % (path, \
                        name, LANGUAGE_ID[lang], section_num)
             print path
 
-            for doc in self.lang_iter(lang):
+            for doc_id, data in self.serialized_docs(lang, doc_id,
+                                                     bigram_list,
+                                                     num_workers,
+                                                     token_records=
+                                                     token_records):
                 if doc_num >= docs_in_sec:
                     print "Done with section ", \
                         section_num, " we've written ", doc_id
                     # Write the file
                     write_proto(filename + ".index", section)
+                    if packer:
+                        packer.close()
+                        packer = None
 
-                    section = self.new_section()
+                    section = new_section()
                     section_num += 1
                     doc_num = 0
                     filename = "%s/%s_%s_%i" % (path, name, LANGUAGE_ID[lang],
                                                   section_num)
-                if not os.path.exists(filename):
+                if not packed and not os.path.exists(filename):
                     os.mkdir(filename)
 
                 assert lang in self._word_lookup, "%i not in vocab, %s" % \
@@ -476,43 +1123,45 @@ class CorpusReader:
                     print "Writing out ", lang, filename, doc_id, "/", \
                         len(self._files[lang])
 
-                if self._bigram_limit > 0:
-                    bf = self._bigram_finder[lang]
-                    doc_proto = doc.proto(doc_id, lang, self._author_lookup,
-                                          self._word_lookup[lang],
-                                          self._word_df[lang],
-                                          self._lemma_lookup[lang],
-                                          self._pos_tag_lookup[lang],
-                                          self._synset_lookup, self._stemmer,
-                                          self._bigram_lookup[lang],
-                                          bigram_list[lang],
-                                          bf.normalize_word)
+                if packed:
+                    if not packer:
+                        packer = PackedSectionWriter(filename + ".index")
+                    packer.add(data)
                 else:
-                    doc_proto = doc.proto(doc_id, lang, self._author_lookup,
-                                          self._word_lookup[lang],
-                                          self._word_df[lang],
-                                          self._lemma_lookup[lang],
-                                          self._pos_tag_lookup[lang],
-                                          self._synset_lookup, self._stemmer)
-
-                write_proto("%s/%i" % (filename, doc_id), doc_proto)
+                    write_serialized("%s/%i" % (filename, doc_id), data)
 
                 section.doc_filenames.append("%s_%s_%i/%i" % \
                                                  (name, LANGUAGE_ID[lang],
                                                   section_num, doc_id))
-                doc_id += 1
                 doc_num += 1
 
             # We don't want to mix languages, so we close out each section when
             # done with a language
 
             if doc_num > 0:
+                # Ids continue across languages
+                doc_id += 1
                 write_proto(filename + ".index", section)
-                section = self.new_section()
+                if packer:
+                    packer.close()
+                    packer = None
+                section = new_section()
                 doc_num = 0
                 section_num += 1
                 filename = "%s/%s_%s_%i" % (path, name, LANGUAGE_ID[lang],
                                             section_num)
-                if not os.path.exists(filename):
+                if not packed and not os.path.exists(filename):
                     os.mkdir(filename)
             print doc_id, " files written"
+            self._next_section[lang] = section_num
+
+        self._next_doc_id = doc_id
+        self.save_manifest(manifest)
+
+        self._stemmer.print_cache_stats()
+        if self._stem_cache:
+            self._stemmer.save_cache(self._stem_cache)
+
+        if self._token_spill is not None:
+            self._token_spill.close()
+            self._token_spill = None
@@ -2,6 +2,8 @@
 # vocabularies.
 
 from topicmod.corpora.proto.corpus_pb2 import *
+from topicmod.corpora.proto_corpus import read_section, read_vocab, \
+    section_documents
 
 
 class TermWrapper:
@@ -21,15 +23,15 @@ def parse_proto_vocab(proto_vocab, destination):
 class CorpusVocabWrapper:
 
     def __init__(self, filename):
-        cp = Corpus()
-        cp.ParseFromString(open(filename, 'r').read())
-
+        self.filename = filename
+        self._section = read_section(filename)
+        cp = read_vocab(filename, self._section)
         self.tokens = {}
         self.lemmas = {}
         self.pos = {}
         self.bigrams = {}
         self.synsets = {}
-        self.filenames = cp.doc_filenames
+        self.filenames = self._section.doc_filenames
 
         self.authors = parse_proto_vocab(cp.authors, {})
 
@@ -49,7 +51,5 @@ class CorpusVocabWrapper:
             self.synsets[ii.language] = parse_proto_vocab(cp.synsets, {})
 
     def docs(self, base):
-        d = Document()
-        for ii in self.filenames:
-            d.ParseFromString(open("%s/%s" % (base, ii), 'r').read())
+        for ii, d in section_documents(base, self.filename, self._section):
             yield d
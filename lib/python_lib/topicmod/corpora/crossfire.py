@@ -30,6 +30,7 @@ def reduce_speaker(speaker):
 
 
 class CrossfireCorpus(CorpusReader):
+    one_doc_per_file = True
 
     def doc_factory(self, lang, filename):
         yield CrossfireDocument(filename, codecs.open(filename).read(), lang)
@@ -124,6 +125,8 @@ class CrossfireDocument(DocumentReader):
               bigram_normalize=None):
 
         d, tf = self.prepare_document(num, language, authors)
+        turns = list(self.author_turns())
+        tfidf = df.sentence_tfidf([ii for aa, ii in turns], token_vocab)
 
         # TODO(jbg): Move the following into an overridden version of
         # prepare_document
@@ -134,11 +137,11 @@ class CrossfireDocument(DocumentReader):
         d.title = self._title
         d.language = language
 
-        for aa, ii in self.author_turns():
+        for (aa, ii), scores in zip(turns, tfidf):
             s = d.sentences.add()
 
             s = self.fill_sentence(s, ii, language, token_vocab, lemma_vocab,
                                    pos, synsets, stemmer, bigram_vocab,
-                                   tf, df, bigram_list, bigram_normalize)
+                                   scores, bigram_list, bigram_normalize)
             s.author = authors[aa]
         return d
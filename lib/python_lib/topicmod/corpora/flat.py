@@ -46,19 +46,16 @@ class FlatDocument(DocumentReader):
 
         d.language = language
 
-        tf_token = nltk.FreqDist()
-
-        for ii in self.sentences():
-            for jj in ii:
-                tf_token.inc(jj)
+        tokens = list(self.tokens())
+        ids = [token_vocab[jj] for jj in tokens]
+        tfidf = token_df.compute_doc_tfidf(ids, token_vocab).tolist()
 
         s = d.sentences.add()
-        for ii in self.sentences():
-            for jj in ii:
-                w = s.words.add()
-                w.token = token_vocab[jj]
-                w.lemma = lemma_vocab[stemmer(language, jj)]
-                w.tfidf = token_df.compute_tfidf(jj, tf_token.freq(jj))
+        for jj, token_id, score in zip(tokens, ids, tfidf):
+            w = s.words.add()
+            w.token = token_id
+            w.lemma = lemma_vocab[stemmer(language, jj)]
+            w.tfidf = score
         return d
 
 
@@ -118,6 +115,7 @@ class FlatEmailDocument(FlatHtmlDocument):
 
 
 class FlatHtmlCorpus(CorpusReader):
+    one_doc_per_file = True
 
     def doc_factory(self, lang, filename):
         try:
@@ -127,6 +125,7 @@ class FlatHtmlCorpus(CorpusReader):
 
 
 class FlatCorpus(CorpusReader):
+    one_doc_per_file = True
 
     def doc_factory(self, lang, filename):
         try:
@@ -136,6 +135,7 @@ class FlatCorpus(CorpusReader):
 
 
 class FlatEmailCorpus(CorpusReader):
+    one_doc_per_file = True
 
     def doc_factory(self, lang, filename):
         try:
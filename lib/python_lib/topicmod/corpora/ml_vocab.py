@@ -1,11 +1,39 @@
+"""
+Vocabularies read from vocab files (one term per line, optionally preceded
+by a language id and a tab).
+
+Big vocab files can be compiled with compile_vocab into a binary file that
+is read through mmap instead of being parsed into dicts.  For every language
+it holds the terms in id order (a table of 64-bit offsets followed by the
+utf-8 data) and two lookup tables sorted by utf-8 bytes, one for the whole
+terms (MultilingualVocab) and one for their ':'-separated expressions
+(Vocab), each with the id of every key.  Lookups are a binary search.
+Vocab and MultilingualVocab use the compiled file when they are given it or
+when filename.cvocab exists and is at least as new as filename.
+"""
+
+from bisect import bisect_left
 from collections import defaultdict
 from string import strip
 import codecs
+import mmap
+import os
+import struct
 
 from topicmod.corpora.proto.corpus_pb2 import *
 
 kLANGUAGE_ID = {0: ENGLISH, 1: GERMAN, 2: CHINESE}
 
+COMPILED_MAGIC = "TMVOCAB1"
+COMPILED_EXTENSION = ".cvocab"
+
+HEADER = struct.Struct("<8sI")
+LANGUAGE_HEADER = struct.Struct("<IIQQ")
+KEY_TABLE = struct.Struct("<IQQQ")
+OFFSET = struct.Struct("<Q")
+SPAN = struct.Struct("<QQ")
+TERM_ID = struct.Struct("<i")
+
 
 def extract_mapping(vocab, output_file=None, existing_mapping={}):
     mapping = existing_mapping
@@ -25,6 +53,213 @@ def extract_mapping(vocab, output_file=None, existing_mapping={}):
     return mapping
 
 
+def term_expressions(term):
+    """
+    The expressions Vocab maps a line of a vocab file to (everything after a
+    '#' is a comment)
+    """
+    return strip(term.split("#")[0]).split(":")
+
+
+def write_strings(o, strings):
+    """
+    Write a table of offsets followed by the strings themselves; returns the
+    positions of both.
+    """
+    offsets = o.tell()
+    position = 0
+    for ii in strings:
+        o.write(OFFSET.pack(position))
+        position += len(ii)
+    o.write(OFFSET.pack(position))
+
+    data = o.tell()
+    for ii in strings:
+        o.write(ii)
+    return offsets, data
+
+
+def write_key_table(o, lookup):
+    """
+    Write the keys of a dict sorted by their utf-8 bytes, then their ids.
+    Returns a KEY_TABLE record.
+    """
+    keys = sorted((x.encode("utf-8"), lookup[x]) for x in lookup)
+    offsets, data = write_strings(o, [x for x, id in keys])
+    ids = o.tell()
+    for word, id in keys:
+        o.write(TERM_ID.pack(id))
+    return KEY_TABLE.pack(len(keys), offsets, data, ids)
+
+
+def compile_vocab(filename, output=None):
+    """
+    Compile a vocab file (every line must have a language id) into the binary
+    format read by CompiledVocab.  Returns the name of the file written.
+    """
+    if output is None:
+        output = filename + COMPILED_EXTENSION
+
+    terms = defaultdict(list)
+    infile = codecs.open(filename, encoding='utf-8', errors="replace")
+    for ii in infile:
+        assert "\t" in ii, "%s: no language in line %s" % (filename, ii)
+        lang, term = ii.split("\t")
+        terms[int(lang)].append(term.strip())
+    infile.close()
+
+    o = open(output, 'wb')
+    o.write(HEADER.pack(COMPILED_MAGIC, len(terms)))
+    directory = o.tell()
+    o.write("\0" * (LANGUAGE_HEADER.size + 2 * KEY_TABLE.size) * len(terms))
+
+    records = []
+    for lang in sorted(terms):
+        exact = {}
+        expressions = {}
+        for id, term in enumerate(terms[lang]):
+            exact[term] = id
+            for jj in term_expressions(term):
+                expressions[jj] = id
+
+        offsets, data = write_strings(o, [x.encode("utf-8") for x in
+                                          terms[lang]])
+        record = LANGUAGE_HEADER.pack(lang, len(terms[lang]), offsets, data)
+        exact_table = write_key_table(o, exact)
+        if expressions == exact:
+            expression_table = exact_table
+        else:
+            expression_table = write_key_table(o, expressions)
+        records.append(record + exact_table + expression_table)
+
+    o.seek(directory)
+    for ii in records:
+        o.write(ii)
+    o.close()
+
+    print "Compiled", sum(len(x) for x in terms.values()), "terms from", \
+        filename, "into", output
+    return output
+
+
+class StringTable:
+    """
+    Strings written by write_strings, read from a buffer as they are needed
+    """
+
+    def __init__(self, data, offsets, strings, length):
+        self._data = data
+        self._offsets = offsets
+        self._strings = strings
+        self._length = length
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, index):
+        if index < 0 or index >= self._length:
+            raise IndexError(index)
+        start, end = SPAN.unpack_from(self._data,
+                                      self._offsets + OFFSET.size * index)
+        return self._data[self._strings + start:self._strings + end]
+
+
+class CompiledVocab:
+    """
+    A vocab file written by compile_vocab, read through mmap
+    """
+
+    def __init__(self, filename):
+        infile = open(filename, 'rb')
+        self._data = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+        infile.close()
+
+        magic, num_languages = HEADER.unpack_from(self._data, 0)
+        assert magic == COMPILED_MAGIC, "%s is not a compiled vocab" % filename
+
+        self._terms = {}
+        self._exact = {}
+        self._expressions = {}
+        position = HEADER.size
+        for ii in xrange(num_languages):
+            lang, num_terms, offsets, data = \
+                LANGUAGE_HEADER.unpack_from(self._data, position)
+            position += LANGUAGE_HEADER.size
+            self._terms[lang] = StringTable(self._data, offsets, data,
+                                            num_terms)
+            for table in [self._exact, self._expressions]:
+                num_keys, offsets, data, ids = \
+                    KEY_TABLE.unpack_from(self._data, position)
+                position += KEY_TABLE.size
+                table[lang] = (StringTable(self._data, offsets, data,
+                                           num_keys), ids)
+
+    def languages(self):
+        return self._terms.keys()
+
+    def num_terms(self, lang):
+        if lang in self._terms:
+            return len(self._terms[lang])
+        else:
+            return 0
+
+    def term(self, lang, id):
+        """
+        The line of the vocab file with this id; raises KeyError if there
+        isn't one
+        """
+        if not lang in self._terms or id < 0 or id >= len(self._terms[lang]):
+            raise KeyError(id)
+        return self._terms[lang][id].decode("utf-8")
+
+    def lookup(self, lang, word, expressions=False):
+        """
+        The id of a term (or, if expressions is set, of one of its
+        expressions), or -1 if it isn't in the vocab
+        """
+        tables = self._exact
+        if expressions:
+            tables = self._expressions
+        if not lang in tables:
+            return -1
+
+        keys, ids = tables[lang]
+        if isinstance(word, unicode):
+            word = word.encode("utf-8")
+        index = bisect_left(keys, word)
+        if index < len(keys) and keys[index] == word:
+            return TERM_ID.unpack_from(self._data,
+                                       ids + TERM_ID.size * index)[0]
+        else:
+            return -1
+
+    def words(self, lang):
+        """
+        Iterate over the distinct terms of a language
+        """
+        if lang in self._exact:
+            keys, ids = self._exact[lang]
+            for ii in keys:
+                yield ii.decode("utf-8")
+
+
+def compiled_vocab(filename):
+    """
+    The CompiledVocab to use for a vocab file, or None if it hasn't been
+    compiled (or has changed since)
+    """
+    infile = open(filename, 'rb')
+    magic = infile.read(len(COMPILED_MAGIC))
+    infile.close()
+    if magic == COMPILED_MAGIC:
+        return CompiledVocab(filename)
+
+    compiled = filename + COMPILED_EXTENSION
+    if os.path.exists(compiled) and \
+            os.path.getmtime(compiled) >= os.path.getmtime(filename):
+        return CompiledVocab(compiled)
+    return None
+
 
 class Vocab:
 
@@ -32,9 +267,17 @@ class Vocab:
         self.word_to_int_ = {}
         self.int_to_word_ = {}
         self.int_to_unicode_ = {}
+        self._compiled = None
+        self._language = filter_language
         index = -1
 
         if filename:
+            self._compiled = compiled_vocab(filename)
+
+        if self._compiled:
+            print "Read", self._compiled.num_terms(filter_language), \
+                "items from", filename, "."
+        elif filename:
             infile = codecs.open(filename, encoding='utf-8', errors="replace")
 
             while True:
@@ -65,9 +308,12 @@ class Vocab:
 
             print "Read", index, "items from", filename, "."
 
+    def compiled_term(self, index):
+        return strip(self._compiled.term(self._language, index).split("#")[0])
+
     def AddWord(self, word):
-        if not word in self.word_to_int_:
-            index = len(self.int_to_word_)
+        if not word in self:
+            index = len(self)
             self.word_to_int_[word] = index
             self.int_to_word_[index] = word
             self.int_to_unicode_[index] = word
@@ -75,21 +321,32 @@ class Vocab:
     def PrintLine(self, line):
         s = ""
         for ii in line:
-            s += "%s:%s " % (self.int_to_word_[ii], line[ii])
+            s += "%s:%s " % (self[ii], line[ii])
         s += "\n"
         return s
 
     def __getitem__(self, val):
         if isinstance(val, int):
-            return self.int_to_word_[val]
+            if val in self.int_to_word_ or not self._compiled:
+                return self.int_to_word_[val]
+            return self.compiled_term(val).encode("ascii", 'replace')
         else:
-            return self.word_to_int_[val]
+            if val in self.word_to_int_ or not self._compiled:
+                return self.word_to_int_[val]
+            index = self._compiled.lookup(self._language, val, True)
+            if index == -1:
+                raise KeyError(val)
+            return index
 
     def __contains__(self, val):
-        return val in self.word_to_int_
+        return val in self.word_to_int_ or (self._compiled and \
+            self._compiled.lookup(self._language, val, True) != -1)
 
     def write(self, file):
         l = [(ii, self.int_to_unicode_[ii]) for ii in self.int_to_unicode_]
+        if self._compiled:
+            l += [(ii, self.compiled_term(ii).split(":")[-1]) for ii in
+                  xrange(self._compiled.num_terms(self._language))]
         l.sort()
 
         o = codecs.open(file, 'w', encoding='utf-8')
@@ -99,6 +356,9 @@ class Vocab:
         print "Wrote", len(l), " lines to vocab file ", file
 
     def __len__(self):
+        if self._compiled:
+            return len(self.int_to_word_) + \
+                self._compiled.num_terms(self._language)
         return len(self.int_to_word_)
 
 
@@ -107,8 +367,12 @@ class MultilingualVocab:
     def __init__(self, filename=""):
         self._lookup = defaultdict(dict)
         self._reverse = defaultdict(dict)
+        self._compiled = None
 
         if filename:
+            self._compiled = compiled_vocab(filename)
+
+        if filename and not self._compiled:
             counts = defaultdict(int)
             infile = codecs.open(filename, encoding="utf-8")
             for ii in infile:
@@ -123,7 +387,25 @@ class MultilingualVocab:
         self._reverse[lang][word] = id
 
     def get_word(self, lang, id):
-        return self._lookup[lang].get(id, "")
+        if id in self._lookup[lang] or not self._compiled:
+            return self._lookup[lang].get(id, "")
+        try:
+            return self._compiled.term(lang, id)
+        except KeyError:
+            return ""
 
     def get_id(self, lang, word):
-        return self._reverse[lang].get(word, -1)
+        if word in self._reverse[lang] or not self._compiled:
+            return self._reverse[lang].get(word, -1)
+        return self._compiled.lookup(lang, word)
+
+    def words(self, lang):
+        """
+        Iterate over every word with an id in a language
+        """
+        for ii in self._reverse[lang]:
+            yield ii
+        if self._compiled:
+            for ii in self._compiled.words(lang):
+                if not ii in self._reverse[lang]:
+                    yield ii
@@ -17,6 +17,7 @@ class NoahBlogPost(DocumentReader):
 
 
 class NoahCorpus(CorpusReader):
+    one_doc_per_file = True
 
     def add_language(self, pattern, language, doc_limit=-1, skip=0):
         files = list(glob(self._file_base + pattern))
@@ -125,6 +125,12 @@ class NewYorkTimesDocument(DocumentReader):
             yield sent
 
     def tokens(self, remove_people=False):
+        if not remove_people:
+            for ii in self.cached_sentences():
+                for jj in ii:
+                    yield jj
+            return
+
         for ii in xrange(len(self.paras_)):
             for jj in self.paragraph_tokens(ii, remove_people):
                 yield jj
@@ -132,6 +138,7 @@ class NewYorkTimesDocument(DocumentReader):
 
 
 class NewYorkTimesReader(CorpusReader):
+    one_doc_per_file = True
 
     def add_language(self, pattern, language=ENGLISH):
         print "Looking for lang", language, "pattern", \
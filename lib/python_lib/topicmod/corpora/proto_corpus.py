@@ -0,0 +1,212 @@
+"""
+Reading and writing the sections of a corpus created by
+CorpusReader.write_proto.
+
+Each section has an index (name.index, a Corpus protocol buffer) whose
+doc_filenames are relative to the corpus directory.  The documents either
+live in a file of their own (the original layout) or are packed together:
+name.pack holds every Document of the section as a record (a little-endian
+32-bit length followed by the serialized protocol buffer), in doc_filenames
+order, and name.offsets holds the byte offset of each record as a
+little-endian 64-bit integer.
+
+Sections may also leave out their vocabularies and instead name a shared
+vocab file (name_version.vocab, a Corpus with no documents) in the same
+directory; read_vocab finds the vocabularies either way.
+"""
+
+import os
+import struct
+from glob import glob
+
+from topicmod.corpora.proto.corpus_pb2 import Corpus, Document
+
+INDEX_EXTENSION = ".index"
+PACK_EXTENSION = ".pack"
+OFFSETS_EXTENSION = ".offsets"
+VOCAB_EXTENSION = ".vocab"
+
+RECORD_LENGTH = struct.Struct("<I")
+OFFSET = struct.Struct("<Q")
+
+# Shared vocabularies are big, so each is only read once
+_shared_vocab = {}
+
+
+def section_base(index_filename):
+    """
+    The filename of a section without the .index extension
+    """
+    if index_filename.endswith(INDEX_EXTENSION):
+        return index_filename[:-len(INDEX_EXTENSION)]
+    else:
+        return index_filename
+
+
+def is_packed(index_filename):
+    return os.path.exists(section_base(index_filename) + PACK_EXTENSION)
+
+
+def read_section(index_filename):
+    section = Corpus()
+    infile = open(index_filename, 'rb')
+    section.ParseFromString(infile.read())
+    infile.close()
+    return section
+
+
+def vocab_filename(name, version):
+    return "%s_%i%s" % (name, version, VOCAB_EXTENSION)
+
+
+def read_vocab(index_filename, section=None):
+    """
+    The Corpus holding the vocabularies of a section: the shared vocab file
+    it names, or the section itself if it has its own copy (as every
+    section written before shared vocab files does).
+    """
+    if section is None:
+        section = read_section(index_filename)
+
+    if not section.HasField("vocab_filename"):
+        return section
+
+    filename = os.path.join(os.path.dirname(index_filename),
+                            section.vocab_filename)
+    if not filename in _shared_vocab:
+        _shared_vocab[filename] = read_section(filename)
+    vocab = _shared_vocab[filename]
+    assert vocab.vocab_version == section.vocab_version, \
+        "%s expects version %i of %s, found %i" % \
+        (index_filename, section.vocab_version, filename,
+         vocab.vocab_version)
+    return vocab
+
+
+def read_document(filename):
+    doc = Document()
+    infile = open(filename, 'rb')
+    doc.ParseFromString(infile.read())
+    infile.close()
+    return doc
+
+
+class PackedSectionWriter:
+    """
+    Writes the documents of a section into a single packed file.
+    """
+
+    def __init__(self, index_filename):
+        base = section_base(index_filename)
+        self._pack = open(base + PACK_EXTENSION, 'wb')
+        self._offsets = open(base + OFFSETS_EXTENSION, 'wb')
+        self._position = 0
+
+    def add(self, data):
+        """
+        Add a serialized Document
+        """
+        self._offsets.write(OFFSET.pack(self._position))
+        self._pack.write(RECORD_LENGTH.pack(len(data)))
+        self._pack.write(data)
+        self._position += RECORD_LENGTH.size + len(data)
+
+    def close(self):
+        self._pack.close()
+        self._offsets.close()
+
+
+class PackedSectionReader:
+    """
+    Reads the documents of a packed section, either in order or by their
+    position in the section.
+    """
+
+    def __init__(self, index_filename):
+        base = section_base(index_filename)
+        self._pack = open(base + PACK_EXTENSION, 'rb')
+        offsets = open(base + OFFSETS_EXTENSION, 'rb').read()
+        self._offsets = [OFFSET.unpack_from(offsets, ii)[0] for ii in
+                         xrange(0, len(offsets), OFFSET.size)]
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def read_record(self):
+        length = RECORD_LENGTH.unpack(self._pack.read(RECORD_LENGTH.size))[0]
+        doc = Document()
+        doc.ParseFromString(self._pack.read(length))
+        return doc
+
+    def __getitem__(self, index):
+        self._pack.seek(self._offsets[index])
+        return self.read_record()
+
+    def __iter__(self):
+        self._pack.seek(0)
+        for ii in xrange(len(self._offsets)):
+            yield self.read_record()
+
+    def close(self):
+        self._pack.close()
+
+
+def section_documents(corpus_dir, index_filename, section=None):
+    """
+    Iterate over (doc_filename, Document) pairs for a section, whether or not
+    it has been packed.  If the section has already been read, pass it in to
+    avoid reading it again.
+    """
+    if section is None:
+        section = read_section(index_filename)
+
+    if is_packed(index_filename):
+        reader = PackedSectionReader(index_filename)
+        assert len(reader) == len(section.doc_filenames), \
+            "%s has %i documents, expected %i" % \
+            (index_filename, len(reader), len(section.doc_filenames))
+        for filename, doc in zip(section.doc_filenames, reader):
+            yield filename, doc
+        reader.close()
+    else:
+        for filename in section.doc_filenames:
+            yield filename, read_document("%s/%s" % (corpus_dir, filename))
+
+
+def corpus_sections(corpus_dir):
+    """
+    The index filenames of a corpus directory
+    """
+    return glob("%s/*%s" % (corpus_dir, INDEX_EXTENSION))
+
+
+def latest_vocab(corpus_dir):
+    """
+    The vocab of the newest section of a corpus (the index file written
+    last), or None if there are no sections.  Appending to a corpus keeps
+    the ids of the terms already in it and adds new ones after them, so
+    this vocab covers every section.  Only that one section is read.
+    """
+    sections = corpus_sections(corpus_dir)
+    if not sections:
+        return None
+    return read_vocab(max(sections, key=os.path.getmtime))
+
+
+def pack_section(corpus_dir, index_filename, remove_documents=False):
+    """
+    Convert a section written one document per file into a packed section.
+    """
+    section = read_section(index_filename)
+    writer = PackedSectionWriter(index_filename)
+    for filename in section.doc_filenames:
+        infile = open("%s/%s" % (corpus_dir, filename), 'rb')
+        writer.add(infile.read())
+        infile.close()
+    writer.close()
+
+    if remove_documents:
+        for filename in section.doc_filenames:
+            os.remove("%s/%s" % (corpus_dir, filename))
+
+    return len(section.doc_filenames)
@@ -2,6 +2,7 @@ import re
 import os.path
 from proto.corpus_pb2 import *
 from proto.wordnet_file_pb2 import *
+from proto_corpus import read_section, read_vocab, section_documents
 from topicmod.util import flags
 from topicmod.util.sets import read_pickle, write_pickle
 
@@ -75,11 +76,9 @@ def getNewMappingDicts(corpusdir, mapsdir):
     # Mapping documents to word
     corpusLocation = corpusdir + "/model_topic_assign/doc_voc.index"
   
-    inputfile = open(corpusLocation, 'rb')
-    protocorpus = Corpus()
-    protocorpus.ParseFromString(inputfile.read())
+    protocorpus = read_section(corpusLocation)
   
-    voc_tokens = protocorpus.tokens
+    voc_tokens = read_vocab(corpusLocation, protocorpus).tokens
   
     word_wid_dic = dict()
     wid_word_dic = dict()
@@ -95,15 +94,10 @@ def getNewMappingDicts(corpusdir, mapsdir):
             wid_word_dic[id] = str(w)
             wid_did_dic[id] = dict()
       
-    docnames = protocorpus.doc_filenames
-  
-    for i in range(0, len(docnames)):
-        docname = docnames[i]
-        doclocation = corpusdir + "/model_topic_assign/" + docname
-        docfile = open(doclocation, 'rb')
-        doc = Document()
-        doc.ParseFromString(docfile.read())
+    docs = section_documents(corpusdir + "/model_topic_assign",
+                             corpusLocation, protocorpus)
     
+    for i, (docname, doc) in enumerate(docs):
         did = i
         did_doc_dic[did] = docname
     
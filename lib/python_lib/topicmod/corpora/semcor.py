@@ -319,6 +319,7 @@ class SemcorDocument(DocumentReader):
 
 
 class SemcorCorpus(CorpusReader):
+    one_doc_per_file = True
 
     def add_language(self, pattern, language=ENGLISH):
         search = self._file_base + pattern
@@ -0,0 +1,30 @@
+import unittest
+
+from topicmod.corpora.vocab_compiler import merge_part_frequencies
+
+
+class MergePartFrequenciesTest(unittest.TestCase):
+
+    def setUp(self):
+        # "the" is a stop word in the first part only
+        self.parts = [("part_0", {0: ({"the": 5, "cat": 2}, set(["the"]))}),
+                      ("part_1", {0: ({"the": 3, "cat": 1}, set())})]
+
+    def test_stop_word_in_one_part(self):
+        freq = merge_part_frequencies(self.parts, True)
+        self.assertEqual(freq[0]["the"], 3)
+        self.assertEqual(freq[0]["cat"], 3)
+
+    def test_stop_word_in_every_part(self):
+        parts = [("part_0", {0: ({"the": 5}, set(["the"]))}),
+                 ("part_1", {0: ({"the": 3}, set(["the"]))})]
+        freq = merge_part_frequencies(parts, True)
+        self.assertFalse("the" in freq[0])
+
+    def test_keep_stop_words(self):
+        freq = merge_part_frequencies(self.parts, False)
+        self.assertEqual(freq[0]["the"], 8)
+
+
+if __name__ == "__main__":
+    unittest.main()
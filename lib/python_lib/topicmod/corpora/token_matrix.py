@@ -0,0 +1,132 @@
+"""
+Flat NumPy arrays of the tokens in a proto corpus, so that scripts that only
+need token ids (and tf-idf) don't have to parse every Document.
+
+export_token_matrix writes five little-endian arrays next to each other:
+
+  base.tokens   int32    token id of every word, document after document
+  base.tfidf    float32  tf-idf of every word
+  base.offsets  int64    where each document starts in tokens (plus the end)
+  base.doc_ids  int32    the Document id of each document
+  base.langs    int32    the Language of each document (token ids are only
+                         unique within a language)
+
+Together tokens and offsets are a CSR matrix (without the values).
+TokenMatrix opens them with numpy.memmap, so loading is instant and several
+processes can share the pages.
+"""
+
+import os
+
+import numpy
+
+from topicmod.corpora.proto_corpus import corpus_sections, \
+    section_documents
+
+TOKEN_TYPE = numpy.dtype("<i4")
+TFIDF_TYPE = numpy.dtype("<f4")
+OFFSET_TYPE = numpy.dtype("<i8")
+DOC_ID_TYPE = numpy.dtype("<i4")
+LANG_TYPE = numpy.dtype("<i4")
+
+
+def map_array(filename, dtype):
+    """
+    Memory-map an array file; numpy.memmap can't map an empty file, so those
+    (e.g. from a corpus without documents) become empty arrays
+    """
+    if os.path.getsize(filename) == 0:
+        return numpy.zeros(0, dtype)
+    return numpy.memmap(filename, dtype=dtype, mode='r')
+
+
+def export_token_matrix(corpus_dir, output_base, sections=None):
+    """
+    Write the arrays for every section of a corpus directory (or the given
+    index files), in sorted section order.  Returns the number of documents
+    written.
+    """
+    if sections is None:
+        sections = sorted(corpus_sections(corpus_dir))
+
+    token_file = open(output_base + ".tokens", 'wb')
+    tfidf_file = open(output_base + ".tfidf", 'wb')
+    offset_file = open(output_base + ".offsets", 'wb')
+    doc_id_file = open(output_base + ".doc_ids", 'wb')
+    lang_file = open(output_base + ".langs", 'wb')
+
+    num_tokens = 0
+    num_docs = 0
+    for ii in sections:
+        tokens = []
+        tfidf = []
+        offsets = []
+        doc_ids = []
+        langs = []
+        for filename, doc in section_documents(corpus_dir, ii):
+            offsets.append(num_tokens + len(tokens))
+            doc_ids.append(doc.id)
+            langs.append(doc.language)
+            for sent in doc.sentences:
+                for word in sent.words:
+                    tokens.append(word.token)
+                    tfidf.append(word.tfidf)
+
+        numpy.array(tokens, dtype=TOKEN_TYPE).tofile(token_file)
+        numpy.array(tfidf, dtype=TFIDF_TYPE).tofile(tfidf_file)
+        numpy.array(offsets, dtype=OFFSET_TYPE).tofile(offset_file)
+        numpy.array(doc_ids, dtype=DOC_ID_TYPE).tofile(doc_id_file)
+        numpy.array(langs, dtype=LANG_TYPE).tofile(lang_file)
+
+        num_tokens += len(tokens)
+        num_docs += len(doc_ids)
+        print "Exported", ii, "(%i documents, %i tokens so far)" % \
+            (num_docs, num_tokens)
+
+    numpy.array([num_tokens], dtype=OFFSET_TYPE).tofile(offset_file)
+
+    for ii in [token_file, tfidf_file, offset_file, doc_id_file, lang_file]:
+        ii.close()
+
+    return num_docs
+
+
+class TokenMatrix:
+    """
+    Memory-mapped view of the arrays written by export_token_matrix.
+    """
+
+    def __init__(self, base):
+        self.tokens = map_array(base + ".tokens", TOKEN_TYPE)
+        self.tfidf = map_array(base + ".tfidf", TFIDF_TYPE)
+        self.offsets = map_array(base + ".offsets", OFFSET_TYPE)
+        self.doc_ids = map_array(base + ".doc_ids", DOC_ID_TYPE)
+        self.langs = map_array(base + ".langs", LANG_TYPE)
+        assert len(self.offsets) == len(self.doc_ids) + 1, \
+            "Inconsistent token matrix %s" % base
+        assert len(self.langs) == len(self.doc_ids), \
+            "Inconsistent token matrix %s" % base
+        assert len(self.tokens) == len(self.tfidf) == self.offsets[-1], \
+            "Inconsistent token matrix %s" % base
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def doc(self, index):
+        """
+        The token ids of the index-th document
+        """
+        return self.tokens[self.offsets[index]:self.offsets[index + 1]]
+
+    def doc_tfidf(self, index):
+        return self.tfidf[self.offsets[index]:self.offsets[index + 1]]
+
+    def doc_lengths(self):
+        return numpy.diff(self.offsets)
+
+    def __iter__(self):
+        """
+        Iterate over (doc id, language, token ids) triples
+        """
+        for ii in xrange(len(self)):
+            yield self.doc_ids[ii], self.langs[ii], self.doc(ii)
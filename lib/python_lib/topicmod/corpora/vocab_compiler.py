@@ -3,6 +3,9 @@
 
 import codecs
 from collections import defaultdict
+from heapq import nsmallest
+from itertools import imap
+from multiprocessing import Pool
 import string
 
 from nltk import FreqDist
@@ -10,8 +13,58 @@ from nltk import FreqDist
 from topicmod.util import flags
 from topicmod.ling.snowball_wrapper import Snowball
 from topicmod.corpora.proto.corpus_pb2 import Corpus
+from topicmod.corpora.proto_corpus import read_vocab
 
 PUNCTUATION = string.punctuation + u'„“–´’'
+SINGLE_LETTERS = set(string.ascii_lowercase)
+
+
+def part_frequencies(job):
+    """
+    Read the vocab of one corpus part (in a worker process).  Returns the
+    path and, for each language, the frequency of every term and the set of
+    terms marked as stop words.
+    """
+    cp_path, use_stem, use_bigram = job
+    cp = read_vocab(cp_path)
+
+    source = cp.tokens
+    if use_stem:
+        source = cp.lemmas
+    if use_bigram:
+        source = cp.bigrams
+
+    counts = {}
+    for ii in source:
+        freq, stop = counts.setdefault(ii.language, (defaultdict(int), set()))
+        for jj in ii.terms:
+            freq[jj.original] += jj.frequency
+            if jj.stop_word:
+                stop.add(jj.original)
+
+    return cp_path, dict((x, (dict(counts[x][0]), counts[x][1]))
+                         for x in counts)
+
+
+def merge_part_frequencies(parts, exclude_stop):
+    """
+    Sum the (path, counts) that part_frequencies returns for each part into
+    a frequency dictionary for each language.  A stop word flag only applies
+    to the part that set it: if exclude_stop, a part's count of a term it
+    marks as a stop word is left out, but the counts of parts that don't
+    mark it are kept, just as calling addVocab on every part would.
+    """
+    freq = {}
+    for path, counts in parts:
+        print path
+        for lang in counts:
+            part_freq, part_stop = counts[lang]
+            total = freq.setdefault(lang, defaultdict(int))
+            for word in part_freq:
+                if exclude_stop and word in part_stop:
+                    continue
+                total[word] += part_freq[word]
+    return freq
 
 
 class VocabCompiler:
@@ -42,10 +95,7 @@ class VocabCompiler:
         """
         Go through the corpus proto
         """
-        cp = Corpus()
-        cp.ParseFromString(open(cp_path, 'rb').read())
-
-        single_letters = list(string.ascii_lowercase)
+        cp = read_vocab(cp_path)
 
         source = cp.tokens
         if use_stem:
@@ -57,40 +107,86 @@ class VocabCompiler:
             lang = ii.language
             for jj in ii.terms:
                 word = jj.original
+                if self.keepTerm(word, jj.stop_word, exclude_stop,
+                                 special_stop, exclude_punctuation,
+                                 exclude_digits, min_length):
+                    self._vocab[lang].inc(word, jj.frequency)
 
-                if jj.stop_word and exclude_stop:
-                    continue
+        print "Languages in this corpus: ", self._vocab.keys()
 
-                if exclude_punctuation and \
-                        all(x in string.punctuation \
-                                for x in word):
-                    continue
+    def keepTerm(self, word, stop_word, exclude_stop, special_stop,
+                 exclude_punctuation, exclude_digits, min_length):
+        """
+        Whether a term makes it through the filters
+        """
+        if stop_word and exclude_stop:
+            return False
 
-                if word in special_stop:
-                    continue
+        if exclude_punctuation and \
+                all(x in string.punctuation \
+                        for x in word):
+            return False
 
-                if len(word) < min_length:
-                    continue
+        if word in special_stop:
+            return False
 
-                if word in single_letters:
-                    continue
+        if len(word) < min_length:
+            return False
 
-                if exclude_digits and all(x in string.digits for \
-                                              x in word):
-                    continue
-                self._vocab[lang].inc(word, jj.frequency)
+        if word in SINGLE_LETTERS:
+            return False
+
+        if exclude_digits and all(x in string.digits for \
+                                      x in word):
+            return False
+
+        return True
+
+    def addVocabParts(self, cp_paths, exclude_stop, special_stop,
+                      exclude_punctuation, exclude_digits, use_stem,
+                      use_bigram, min_length, num_workers=1):
+        """
+        Like calling addVocab on every part, but the parts are read in
+        num_workers processes and their frequencies summed before filtering,
+        so each distinct term is only filtered once (see
+        merge_part_frequencies for how stop words are handled).
+        """
+        jobs = [(x, use_stem, use_bigram) for x in cp_paths]
+        pool = None
+        if num_workers > 1:
+            pool = Pool(num_workers)
+            parts = pool.imap(part_frequencies, jobs)
+        else:
+            parts = imap(part_frequencies, jobs)
+
+        freq = merge_part_frequencies(parts, exclude_stop)
+
+        if pool:
+            pool.close()
+            pool.join()
+
+        for lang in freq:
+            for word in freq[lang]:
+                if self.keepTerm(word, False, exclude_stop,
+                                 special_stop, exclude_punctuation,
+                                 exclude_digits, min_length):
+                    self._vocab[lang].inc(word, freq[lang][word])
 
         print "Languages in this corpus: ", self._vocab.keys()
 
     def writeVocab(self, filename, vocab_limit, min_freq):
+        """
+        Write the (up to vocab_limit + 1) most frequent terms of each
+        language that appear at least min_freq times, most frequent first.
+        """
         o = codecs.open(filename, 'w', 'utf-8')
-        num_terms = defaultdict(int)
         for ii in self._vocab:
-            for jj in self._vocab[ii]:
-                if num_terms[ii] <= vocab_limit and \
-                        self._vocab[ii][jj] >= min_freq:
-                    num_terms[ii] += 1
-                    o.write(u"%i\t%s\n" % (ii, jj))
+            # Same order as iterating over the FreqDist, without sorting it
+            top = nsmallest(vocab_limit + 1,
+                            ((-count, word) for word, count in
+                             self._vocab[ii].iteritems() if count >= min_freq))
+            for count, jj in top:
+                o.write(u"%i\t%s\n" % (ii, jj))
         o.close()
 
     def __getitem__(self, val):
@@ -32,6 +32,11 @@ class WackyDocument(DocumentReader):
             for jj in self._sentences[ii]:
                 yield jj.word
 
+    def sentences(self):
+        num_sentences = max(self._sentences) + 1
+        for ii in xrange(num_sentences):
+            yield [jj.word for jj in self._sentences[ii]]
+
     def pos_tags(self):
         num_sentences = max(self._sentences) + 1
         for ii in xrange(num_sentences):
@@ -90,9 +95,8 @@ class WackyDocument(DocumentReader):
         d.title = self.title.strip()
         num_sentences = max(self._sentences) + 1
 
-        tf_token = FreqDist()
-        for ii in self.tokens():
-            tf_token.inc(ii)
+        ids = [token_vocab[jj] for jj in self.tokens()]
+        tfidf = iter(token_df.compute_doc_tfidf(ids, token_vocab).tolist())
 
         for ii in xrange(num_sentences):
             s = d.sentences.add()
@@ -104,8 +108,7 @@ class WackyDocument(DocumentReader):
                 w.relation = pos_vocab[jj.rel]
                 w.parent = jj.parent
                 w.offset = jj.offset
-                w.tfidf = token_df.compute_tfidf(jj.word,
-                                                 tf_token.freq(jj.word))
+                w.tfidf = tfidf.next()
         return d
 
 
@@ -125,11 +128,33 @@ class WackyCorpus(CorpusReader):
             print ii
             self._files[language].add(ii)
 
+    def doc_keys(self, lang, filename):
+        """
+        Documents are numbered by their position among the texts of a file,
+        so sampling can count them without parsing them.
+        """
+        content_file = gzip.open(filename, 'r')
+        index = 0
+        for ii in content_file:
+            if ii.startswith("</text>"):
+                yield index
+                index += 1
+        content_file.close()
+
     def doc_factory(self, lang, filename):
+        return self.sampled_doc_factory(lang, filename, None)
+
+    def sampled_doc_factory(self, lang, filename, keep):
+        """
+        Only parse the texts whose positions are in keep (or all of them if
+        keep is None).  Short texts are skipped, so a sample can come out a
+        little smaller than requested.
+        """
         content_file = gzip.open(filename, 'r')
 
         buffer = defaultdict(list)
         current_sentence = 0
+        index = 0
 
         for ii in latin_iter(content_file):
             if ii.startswith("<s>"):
@@ -140,12 +165,14 @@ class WackyCorpus(CorpusReader):
             elif ii.startswith("</s>"):
                 current_sentence += 1
             elif ii.startswith("</text>"):
-                wd = WackyDocument(lang, buffer, title)
-                print len(buffer), wd.num_sentences()
-                if wd.num_sentences() > 20:
-                    yield wd
+                if keep is None or index in keep:
+                    wd = WackyDocument(lang, buffer, title)
+                    print len(buffer), wd.num_sentences()
+                    if wd.num_sentences() > 20:
+                        yield wd
 
                 buffer = defaultdict(list)
                 title = ""
-            else:
+                index += 1
+            elif keep is None or index in keep:
                 buffer[current_sentence].append(WackyLine(ii))
@@ -1,13 +1,17 @@
 
+from array import array
 from string import punctuation
 from collections import defaultdict
+from time import time
 
+import numpy
 from scipy import zeros
-from scipy.stats import chisquare
+from scipy.stats import chisquare, chi2
 
 from nltk.util import ibigrams
 
 from topicmod.ling.stop import StopWords
+from topicmod.util.sketch import CountMinSketch
 
 
 def text_to_bigram(text, bigrams, normalize):
@@ -51,11 +55,26 @@ def text_to_bigram_offset(text, bigrams, normalize):
         yield ii
 
 
+# Association measures score_all can compute
+ASSOCIATION_MEASURES = ["chisq", "llr", "pmi"]
+
+
 class BigramFinder:
+    """
+    Finds significant bigrams.  Adjacent pairs are counted exactly by
+    default.  If sketch_width is positive, pairs of word ids are instead
+    counted in a count-min sketch (sketch_depth rows of sketch_width
+    counters), and only pairs whose estimated count reaches min_ngram are
+    remembered as candidates; whenever there are more than max_candidates,
+    only the half with the largest estimates are kept.  Memory is then fixed
+    (apart from the word ids), and the counts of the bigrams found are over
+    by at most the bound find_ngrams prints.
+    """
 
     def __init__(self, additional_stop = [], remove_stop = [], 
                  min_unigram = 10, min_ngram = 5,
-                 exclude=[], language="english"):
+                 exclude=[], language="english", sketch_width=0,
+                 sketch_depth=4, max_candidates=1000000):
 
         print("Loading stopwords for %s" % language)
         self._stopwords = StopWords()[language] | set(additional_stop)
@@ -76,6 +95,16 @@ class BigramFinder:
 
         self._invalid_chars = set(punctuation)
 
+        self._sketch = None
+        if sketch_width > 0:
+            self._sketch = CountMinSketch(sketch_width, sketch_depth)
+        self._max_candidates = max_candidates
+        self._candidates = set()
+        self._word_ids = {}
+        self._words = []
+        self._pending_left = array('l')
+        self._pending_right = array('l')
+
     def normalize_word(self, word):
         word = word.lower()
         reduced = "".join(x for x in word if not x in self._invalid_chars)
@@ -123,12 +152,113 @@ class BigramFinder:
             del self._unigram[ii]
 
     def add_ngram_counts(self, tokens):
+        if self._sketch is not None:
+            self.count_adjacent(x if x in self._unigram else None
+                                for x in tokens)
+            return
+
         for ngram in ibigrams(tokens):
             if all(x in self._unigram for x in ngram):
                 self._dual[ngram] += 1        
 
+    def word_id(self, word):
+        if not word in self._word_ids:
+            self._word_ids[word] = len(self._words)
+            self._words.append(word)
+        return self._word_ids[word]
+
+    def count_adjacent(self, tokens, batch_size=1000000):
+        """
+        Count adjacent pairs approximately (tokens that are None aren't part
+        of any pair).  Unlike add_ngram_counts, this doesn't need the unigram
+        counts yet; pairs with infrequent words are dropped by find_ngrams.
+        """
+        assert self._sketch is not None, "Sketch counting wasn't enabled"
+        last = -1
+        for ii in tokens:
+            if ii is None:
+                last = -1
+                continue
+            current = self.word_id(ii)
+            if last >= 0:
+                self._pending_left.append(last)
+                self._pending_right.append(current)
+            last = current
+
+        if len(self._pending_left) >= batch_size:
+            self.flush_pairs()
+
+    def flush_pairs(self):
+        """
+        Add the pending pairs to the sketch and remember those that might be
+        frequent enough.
+        """
+        if not self._pending_left:
+            return
+
+        keys = (numpy.frombuffer(self._pending_left, numpy.int_).
+                astype(numpy.int64) << 32) | \
+                numpy.frombuffer(self._pending_right, numpy.int_)
+        self._pending_left = array('l')
+        self._pending_right = array('l')
+
+        self._sketch.add(keys)
+        keys = numpy.unique(keys)
+        frequent = keys[self._sketch.estimate(keys) >= self._min_ngram]
+        self._candidates.update(frequent.tolist())
+
+        if len(self._candidates) > self._max_candidates:
+            self.prune_candidates(self._max_candidates // 2)
+
+    def prune_candidates(self, size):
+        """
+        Keep the size candidates with the largest estimated counts.  Since
+        the sketch remembers every count, a pruned pair that comes back later
+        gets its full count.
+        """
+        keys = numpy.fromiter(self._candidates, numpy.int64,
+                              len(self._candidates))
+        estimates = self._sketch.estimate(keys)
+        keep = numpy.argsort(-estimates, kind="mergesort")[:size]
+        self._candidates = set(keys[keep].tolist())
+        print("Pruned bigram candidates to %i (smallest count kept: %i)" %
+              (len(keep), estimates[keep[-1]]))
+
+    def add_sketch_counts(self):
+        """
+        Move the candidates' estimated counts into the bigram counts.
+        """
+        self.flush_pairs()
+        keys = numpy.fromiter(self._candidates, numpy.int64,
+                              len(self._candidates))
+        estimates = self._sketch.estimate(keys)
+        for key, count in zip(keys.tolist(), estimates.tolist()):
+            ngram = (self._words[key >> 32], self._words[key & 0xffffffff])
+            if all(x in self._unigram for x in ngram):
+                self._dual[ngram] += count
+
+        bound, probability = self._sketch.error_bound()
+        print("%i candidate bigrams from %i pairs; counts are over by at most "
+              "%0.1f with probability %0.3f" %
+              (len(self._candidates), self._sketch.total(), bound,
+               probability))
+        self._candidates = set()
+
+    def add_ngram_pair_counts(self, counts):
+        """
+        Add (ngram, count) pairs that were counted elsewhere (e.g. while
+        building the vocab).  Each ngram should appear only once, so counts
+        below min_ngram can be dropped right away.
+        """
+        for ngram, count in counts:
+            if count >= self._min_ngram and \
+                    all(x in self._unigram for x in ngram):
+                self._dual[ngram] += count
+
     def find_ngrams(self, tokens = []):
         self.add_ngram_counts(tokens)
+        if self._sketch is not None:
+            self.add_sketch_counts()
 
         to_delete = set()
         for ngram in self._dual:
@@ -145,12 +275,90 @@ class BigramFinder:
             self._left[ll] += count
             self._right[rr] += count
 
-    def real_ngrams(self, cutoff):
+    def contingency(self):
+        """
+        The candidate bigrams (as a list) and arrays of, for each, its count,
+        the number of candidates its left word starts, the number its right
+        word ends, and whether it contains an excluded word.
+        """
+        ngrams = self._dual.keys()
+        num = len(ngrams)
+        dual = numpy.fromiter((self._dual[x] for x in ngrams), float, num)
+        left = numpy.fromiter((self._left[x[0]] for x in ngrams), float, num)
+        right = numpy.fromiter((self._right[x[1]] for x in ngrams), float,
+                               num)
+        excluded = numpy.fromiter((any(y in self._exclude_from_bigram
+                                       for y in x) for x in ngrams), bool, num)
+        return ngrams, dual, left, right, excluded
+
+    def score_all(self, measures=["chisq"]):
+        """
+        Score every candidate at once.  Returns the candidates and a
+        dictionary from each measure to an array of their scores:
+
+          chisq - the same p-value as score()
+          llr   - log-likelihood ratio (G^2) of the 2x2 contingency table
+          pmi   - pointwise mutual information
+
+        Bigrams with excluded words score 0.
+        """
+        start = time()
+        ngrams, dual, left, right, excluded = self.contingency()
+        total = float(self._total)
+
+        scores = {}
+        old_settings = numpy.seterr(divide='ignore', invalid='ignore')
+        for mm in measures:
+            if mm == "chisq":
+                # score() tests whether the bigram count and the right word
+                # count are uniform, which simplifies to this statistic
+                val = chi2.sf((dual - right) ** 2 / (dual + right), 1)
+            elif mm == "llr":
+                observed = [dual, left - dual, right - dual,
+                            total - left - right + dual]
+                expected = [left * right, left * (total - right),
+                            (total - left) * right,
+                            (total - left) * (total - right)]
+                val = numpy.zeros(len(ngrams))
+                for oo, ee in zip(observed, expected):
+                    val += numpy.where(oo > 0, oo * numpy.log(oo * total / ee),
+                                       0.0)
+                val *= 2.0
+            elif mm == "pmi":
+                val = numpy.log(dual * total / (left * right))
+            else:
+                raise ValueError("Unknown association measure %s" % mm)
+            val[excluded] = 0.0
+            scores[mm] = val
+        numpy.seterr(**old_settings)
+
+        print("Scored %i bigrams (%s) in %0.2f seconds" %
+              (len(ngrams), ", ".join(measures), time() - start))
+        return ngrams, scores
+
+    def bigram_table(self, rank_by="chisq", cutoff=None, limit=-1,
+                     measures=ASSOCIATION_MEASURES):
+        """
+        A list of (bigram, count, scores) tuples, where scores is a
+        dictionary of each measure's score, sorted by the rank_by measure
+        (highest first).  If cutoff is given, only bigrams whose rank_by
+        score is above it are kept; if limit is positive, only that many.
+        """
+        ngrams, scores = self.score_all(list(set(measures) | set([rank_by])))
+        rank = scores[rank_by]
+        order = numpy.argsort(-rank, kind="mergesort")
+        if cutoff is not None:
+            order = order[rank[order] > cutoff]
+        if limit > 0:
+            order = order[:limit]
+        return [(ngrams[ii], self._dual[ngrams[ii]],
+                 dict((x, scores[x][ii]) for x in scores)) for ii in order]
+
+    def real_ngrams(self, cutoff, measure="chisq"):
+        ngrams, scores = self.score_all([measure])
         d = {}
-        for ii in self._dual:
-            score = self.score(ii)
-            if score > cutoff:
-                d[ii] = self._dual[ii]
+        for ii in numpy.flatnonzero(scores[measure] > cutoff):
+            d[ngrams[ii]] = self._dual[ngrams[ii]]
         return d
 
     def print_ngrams(self, limit=10):
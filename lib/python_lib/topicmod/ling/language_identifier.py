@@ -5,10 +5,11 @@ import codecs
 from glob import glob
 from PyML import *
 
-import nltk
 from nltk import FreqDist
 from nltk.util import ingrams
 
+from topicmod.ling.resources import punkt
+
 LANG_LOOKUP = {'en': 'english', 'de': 'german'}
 
 class TrainingData:
@@ -46,7 +47,7 @@ class LanguageIdentifier:
         train = TrainingData()
         self.tokenizers = {}
         for ii in langs:
-            self.tokenizers[ii] = nltk.data.load('tokenizers/punkt/%s.pickle' % LANG_LOOKUP[ii])
+            self.tokenizers[ii] = punkt(LANG_LOOKUP[ii])
             print location, ii
             filename = glob(location + "/%s*/sentences.txt" % ii)[0]
 
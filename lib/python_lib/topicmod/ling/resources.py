@@ -0,0 +1,31 @@
+"""
+One place to get the NLTK resources that are slow to load (Punkt sentence
+tokenizers and stop word lists).  Nothing is loaded when this module is
+imported; each resource is loaded for a language the first time it's asked
+for and shared with everything else that asks for it afterwards.
+"""
+
+import nltk.data
+
+from topicmod.ling.stop import StopWords
+
+_punkt = {}
+_stop_words = StopWords()
+
+
+def punkt(language="english"):
+    """
+    The Punkt sentence tokenizer for a language (e.g. "english").  Raises
+    LookupError if NLTK doesn't have a model for the language.
+    """
+    if not language in _punkt:
+        _punkt[language] = nltk.data.load('tokenizers/punkt/%s.pickle' %
+                                          language)
+    return _punkt[language]
+
+
+def stop_words(language="english"):
+    """
+    The set of stop words for a language
+    """
+    return _stop_words[language]
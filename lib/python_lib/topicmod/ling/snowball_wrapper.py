@@ -2,6 +2,9 @@ from nltk.stem.snowball import *
 from topicmod.corpora.proto.corpus_pb2 import *
 
 import string
+from collections import defaultdict
+
+from topicmod.util.sets import read_pickle, write_pickle
 
 
 class IdStemmer:
@@ -28,18 +31,52 @@ class MorphyStemmer:
 
 
 class Snowball:
+    """
+    Stems words of any language we have a stemmer for.  Stems are cached
+    (up to max_cache words per language), so each distinct word is only
+    stemmed once.  Once a language's cache is full, new words are stemmed
+    but not added; since word frequencies are Zipfian, the frequent words
+    are almost all cached by then.
 
-    def __init__(self):
+    Worker processes forked after stemming share the cache, and save_cache
+    and load_cache keep it between runs.  Workers that stem on their own can
+    send back new_stems for the parent to add with add_stems.
+    """
+
+    def __init__(self, max_cache=500000):
         self._stemmers = {}
         self._lang_lookup = {ENGLISH: 'english', GERMAN: 'german',
                              DIXIE: 'english'}
         self._trans = dict((ord(x), None) for x in \
                                string.punctuation.decode('utf-8'))
 
+        self._max_cache = max_cache
+        self._cache = defaultdict(dict)
+        # The words cached by this stemmer (rather than loaded or added)
+        self._new = defaultdict(dict)
+        self._hits = defaultdict(int)
+        self._misses = defaultdict(int)
+
     def __call__(self, lang, word, remove_punc=True):
         """
         Stem
         """
+        cache = self._cache[lang]
+        if word in cache:
+            self._hits[lang] += 1
+            return cache[word]
+
+        self._misses[lang] += 1
+        val = self.stem(lang, word)
+        if len(cache) < self._max_cache:
+            cache[word] = val
+            self._new[lang][word] = val
+        return val
+
+    def stem(self, lang, word):
+        """
+        Stem without looking at the cache
+        """
         if not lang in self._stemmers:
             if lang in [CHINESE]:
                 self._stemmers[lang] = IdStemmer()
@@ -52,3 +89,45 @@ class Snowball:
         val = self._stemmers[lang].stem(word)
 
         return val
+
+    def cache_stats(self):
+        """
+        A dictionary from language to (hits, misses, cached words)
+        """
+        return dict((x, (self._hits[x], self._misses[x], len(self._cache[x])))
+                    for x in self._cache)
+
+    def print_cache_stats(self):
+        for lang, (hits, misses, size) in sorted(self.cache_stats().items()):
+            total = hits + misses
+            if total > 0:
+                print("Stem cache for language %i: %i words, %i / %i hits "
+                      "(%0.2f%%)" % (lang, size, hits, total,
+                                     100.0 * hits / total))
+
+    def save_cache(self, filename):
+        write_pickle(dict((x, self._cache[x]) for x in self._cache), filename)
+
+    def load_cache(self, filename):
+        """
+        Add the stems saved by save_cache to the cache
+        """
+        self.add_stems(read_pickle(filename))
+
+    def new_stems(self):
+        """
+        The stems (language -> word -> stem) this stemmer has cached itself
+        """
+        return dict((x, self._new[x]) for x in self._new)
+
+    def add_stems(self, stems):
+        """
+        Add stems (language -> word -> stem) to the cache, e.g. the new_stems
+        of another process
+        """
+        for lang, words in stems.iteritems():
+            cache = self._cache[lang]
+            for word in words:
+                if len(cache) >= self._max_cache:
+                    break
+                cache[word] = words[word]
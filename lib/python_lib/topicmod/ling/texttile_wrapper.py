@@ -10,7 +10,8 @@ import nltk
 from nltk.tokenize.texttiling import TextTilingTokenizer
 from nltk.data import load
 
-punkt = nltk.data.load("nltk:tokenizers/punkt/english.pickle")
+from topicmod.ling.resources import punkt
+
 punct_regexp = re.compile("[\w\s\\']+\W")
 
 class TexttileWrapper:
@@ -54,7 +55,7 @@ class TexttileWrapper:
                            max_sentences_per_texttile = 15,
                            arbitrary_sentences_per_tile = 6):
         # First, try to segment into sentences with punkt
-        sentences = punkt.tokenize(text)
+        sentences = punkt("english").tokenize(text)
 
         # If that doesn't work, use a really stupid regexp
         longest_sentence = max(len(x) for x in sentences)
@@ -1,7 +1,7 @@
 #!/usr/bin/python
 #-*- coding: latin-1 -*-
 
-import nltk.data
+import nltk
 
 from string import lower, punctuation
 from collections import defaultdict
@@ -9,7 +9,7 @@ from collections import defaultdict
 from nltk.stem import PorterStemmer
 from nltk.corpus import wordnet as wn
 
-from topicmod.ling.stop import StopWords
+from topicmod.ling.resources import punkt, stop_words
 
 porter = PorterStemmer()
 porter_stem = porter.stem
@@ -21,28 +21,28 @@ def morphy_stem(s):
     else:
         return s
 
-stopwords = StopWords()
-english_stopwords = stopwords.load("english")
-arabic_stopwords = stopwords.load("arabic")
-
-tokenizer = nltk.data.load('tokenizers/punkt/english.pickle')
+# Stop words and the sentence tokenizer are loaded when they're first used
 
 def default_tokenize(raw_text):
-    sentences = tokenizer.tokenize(raw_text)
+    sentences = punkt("english").tokenize(raw_text)
     for ii in sentences:
         for jj in nltk.word_tokenize(ii):
             yield jj
 
 def map_token_func(raw_token,
                    min_length = 3,
-                   stopwords = english_stopwords):
+                   stopwords = None):
+    if stopwords is None:
+        stopwords = stop_words("english")
     raw_token = raw_token.lower()
     if len(raw_token) < min_length or raw_token in stopwords:
         return ""
     else:
         return stem(raw_token)
 
-def tokens(raw_text, min_length = 3, stopwords = english_stopwords, stem_words="morphy", exclude_punctuation = True, tokenize_function=default_tokenize):
+def tokens(raw_text, min_length = 3, stopwords = None, stem_words="morphy", exclude_punctuation = True, tokenize_function=default_tokenize):
+    if stopwords is None:
+        stopwords = stop_words("english")
     raw_text = raw_text.replace("\n", " ")
     tokens = map(lower, tokenize_function(raw_text))
     #print tokens[:10]
@@ -60,7 +60,9 @@ def tokens(raw_text, min_length = 3, stopwords = english_stopwords, stem_words="
 
     return tokens
 
-def tokens_arabic(raw_text, min_length = 1, stopwords = arabic_stopwords):
+def tokens_arabic(raw_text, min_length = 1, stopwords = None):
+    if stopwords is None:
+        stopwords = stop_words("arabic")
     raw_text = raw_text.replace("\n", " ")
 
     # Preprocessing has taken care of the hard stuff for us
@@ -1,5 +1,9 @@
+import sys
 import random
 import pickle
+import threading
+from Queue import Queue, Full
+from collections import deque
 
 def dict_sample(d):
     """
@@ -104,6 +108,82 @@ def poll_iterator(iter_list, shuffle=True):
                     alive[ii] = False
     return
 
+class Prefetcher:
+    """
+    Reads an iterable in a background thread, staying at most depth items
+    ahead of whoever is iterating over it.  Items come out in the same order
+    they went in.  Exceptions raised by the iterable are raised again when
+    iterating.
+    """
+
+    ITEM, DONE, ERROR = range(3)
+
+    def __init__(self, iterable, depth=100):
+        self._items = Queue(depth)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._produce,
+                                        args=(iterable,))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _put(self, item):
+        while not self._stop.is_set():
+            try:
+                self._items.put(item, True, 0.1)
+                return True
+            except Full:
+                continue
+        return False
+
+    def _produce(self, iterable):
+        try:
+            for ii in iterable:
+                if not self._put((self.ITEM, ii)):
+                    return
+            self._put((self.DONE, None))
+        except:
+            self._put((self.ERROR, sys.exc_info()))
+
+    def __iter__(self):
+        try:
+            while True:
+                kind, value = self._items.get()
+                if kind == self.DONE:
+                    return
+                elif kind == self.ERROR:
+                    raise value[0], value[1], value[2]
+                yield value
+        finally:
+            self.close()
+
+    def close(self):
+        """
+        Stop reading (e.g. if we aren't going to use the rest of the items)
+        and wait for the background thread to finish the item it's on
+        """
+        self._stop.set()
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+
+def prefetch_chain(iterables, ahead=2, depth=100):
+    """
+    Like itertools.chain, but while one iterable is being used, the next
+    ahead of them are read in background threads.
+    """
+    running = deque()
+    try:
+        for ii in iterables:
+            running.append(Prefetcher(ii, depth))
+            if len(running) > ahead:
+                for jj in running.popleft():
+                    yield jj
+        while running:
+            for jj in running.popleft():
+                yield jj
+    finally:
+        for ii in running:
+            ii.close()
+
 def write_pickle(obj, filename, protocol=-1):
     """
     I can never remember the syntax
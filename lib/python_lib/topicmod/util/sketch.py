@@ -0,0 +1,63 @@
+"""
+Approximate counting in a fixed amount of memory.
+"""
+
+from math import e, exp
+
+import numpy
+
+
+class CountMinSketch:
+    """
+    A count-min sketch of integer keys: depth rows of width counters, with
+    each key hashed to one counter in every row.  Estimates never undercount,
+    and with probability at least 1 - exp(-depth) an estimate is over by at
+    most e / width times the total of everything added (error_bound).
+    """
+
+    PRIME = 2147483647
+
+    def __init__(self, width, depth=4, seed=0):
+        rand = numpy.random.RandomState(seed)
+        self._a = rand.randint(1, self.PRIME, depth).astype(numpy.int64)
+        self._b = rand.randint(0, self.PRIME, depth).astype(numpy.int64)
+        self._table = numpy.zeros((depth, width), numpy.int64)
+        self._width = width
+        self._total = 0
+
+    def columns(self, row, keys):
+        """
+        Where keys (a numpy int64 array) are counted in a row
+        """
+        return (self._a[row] * (keys % self.PRIME) + self._b[row]) % \
+            self.PRIME % self._width
+
+    def add(self, keys, counts=None):
+        keys = numpy.asarray(keys, numpy.int64)
+        if counts is None:
+            counts = numpy.ones(len(keys), numpy.int64)
+        else:
+            counts = numpy.asarray(counts, numpy.int64)
+
+        for row in xrange(len(self._a)):
+            row_counts = numpy.bincount(self.columns(row, keys), counts,
+                                        self._width)
+            self._table[row] += row_counts.astype(numpy.int64)
+        self._total += int(counts.sum())
+
+    def estimate(self, keys):
+        keys = numpy.asarray(keys, numpy.int64)
+        val = self._table[0][self.columns(0, keys)]
+        for row in xrange(1, len(self._a)):
+            val = numpy.minimum(val, self._table[row][self.columns(row, keys)])
+        return val
+
+    def total(self):
+        return self._total
+
+    def error_bound(self):
+        """
+        How much an estimate can be over, and the probability that it's
+        within that
+        """
+        return e * self._total / self._width, 1.0 - exp(-len(self._a))
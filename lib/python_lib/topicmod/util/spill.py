@@ -0,0 +1,134 @@
+"""
+Containers that keep a bounded amount of data in memory and spill the rest
+to disk.  Used when building corpora that are too big to hold statistics for
+in memory.
+"""
+
+import os
+import shutil
+import cPickle
+from heapq import merge
+from tempfile import mkdtemp
+from collections import defaultdict
+
+
+def read_records(filename):
+    """
+    Iterate over the pickled records written to a file one at a time.
+    """
+    infile = open(filename, 'rb')
+    try:
+        while True:
+            try:
+                yield cPickle.load(infile)
+            except EOFError:
+                break
+    finally:
+        infile.close()
+
+
+class SpillCounter:
+    """
+    A counter that keeps at most max_keys distinct keys in memory.  When it
+    grows past that, the counts are sorted and written to a run on disk.
+    items() merges the runs back together, so the totals are exact.
+    """
+
+    def __init__(self, max_keys=1000000, spill_dir=None):
+        self._counts = defaultdict(int)
+        self._max_keys = max_keys
+        self._spill_dir = spill_dir
+        self._owns_dir = False
+        self._runs = []
+
+    def inc(self, key, count=1):
+        self._counts[key] += count
+        if len(self._counts) > self._max_keys:
+            self.spill()
+
+    def spill(self):
+        """
+        Write the in-memory counts to a sorted run on disk.
+        """
+        if not self._counts:
+            return
+
+        if self._spill_dir is None:
+            self._spill_dir = mkdtemp(prefix="spill_counter")
+            self._owns_dir = True
+
+        filename = "%s/run_%i_%04i" % (self._spill_dir, id(self),
+                                       len(self._runs))
+        o = open(filename, 'wb')
+        for item in sorted(self._counts.iteritems()):
+            cPickle.dump(item, o, -1)
+        o.close()
+
+        print "Spilled", len(self._counts), "counts to", filename
+        self._runs.append(filename)
+        self._counts = defaultdict(int)
+
+    def items(self):
+        """
+        Iterate over (key, count) pairs in sorted key order, with the counts
+        summed over every run.
+        """
+        runs = [read_records(x) for x in self._runs]
+        runs.append(iter(sorted(self._counts.iteritems())))
+
+        first = True
+        for key, count in merge(*runs):
+            if first:
+                current, total = key, count
+                first = False
+            elif key == current:
+                total += count
+            else:
+                yield current, total
+                current, total = key, count
+        if not first:
+            yield current, total
+
+    def close(self):
+        for ii in self._runs:
+            os.remove(ii)
+        self._runs = []
+        self._counts = defaultdict(int)
+        if self._owns_dir:
+            shutil.rmtree(self._spill_dir, True)
+            self._spill_dir = None
+            self._owns_dir = False
+
+
+class SpillRecords:
+    """
+    An append-only sequence of records kept in a file on disk that can be
+    read back in order (as many times as needed).
+    """
+
+    def __init__(self, spill_dir=None):
+        self._owns_dir = spill_dir is None
+        if spill_dir is None:
+            spill_dir = mkdtemp(prefix="spill_records")
+        self._filename = "%s/records_%i" % (spill_dir, id(self))
+        self._spill_dir = spill_dir
+        self._out = open(self._filename, 'wb')
+        self._num_records = 0
+
+    def append(self, record):
+        cPickle.dump(record, self._out, -1)
+        self._num_records += 1
+
+    def __len__(self):
+        return self._num_records
+
+    def __iter__(self):
+        self._out.flush()
+        return read_records(self._filename)
+
+    def close(self):
+        self._out.close()
+        if os.path.exists(self._filename):
+            os.remove(self._filename)
+        if self._owns_dir:
+            shutil.rmtree(self._spill_dir, True)
@@ -1,10 +1,10 @@
 
-import codecs
-
 from collections import defaultdict
 
 from topicmod.util import flags
 from topicmod.ling.dictionary import DingEntries
+from topicmod.corpora.ml_vocab import MultilingualVocab
+from topicmod.corpora.proto.corpus_pb2 import ENGLISH, GERMAN
 
 flags.define_string("vocab", "", "Where we read vocab")
 flags.define_float("smoothing", 0.001, "Smoothing amount")
@@ -14,37 +14,33 @@ flags.define_string("output", "lda/lambda", "Lambda output")
 if __name__ == "__main__":
   flags.InitFlags()
 
-  vocab = defaultdict(dict)
-  index = defaultdict(int)
-
-  for ii in codecs.open(flags.vocab):
-    lang, word = ii.split("\t")
-    lang = int(lang)
-    vocab[lang][word.strip()] = index[lang]
-    index[lang] += 1
+  vocab = MultilingualVocab(flags.vocab)
 
   trans = defaultdict(set)
   sum = defaultdict(float)
-  for ii in vocab[0]:
-    for jj in vocab[1]:
-      if ii == jj:
-        if vocab[1][jj] % 100 == 0:
-          print "ID", jj, ii
-        trans[vocab[1][jj]].add(vocab[0][ii])
+  for ii in vocab.words(ENGLISH):
+    de_id = vocab.get_id(GERMAN, ii)
+    if de_id != -1:
+      if de_id % 100 == 0:
+        print "ID", ii, ii
+      trans[de_id].add(vocab.get_id(ENGLISH, ii))
 
   for en, de in DingEntries("en", "de"):
     for ii in en.words():
-      if not ii in vocab[0]:
+      en_id = vocab.get_id(ENGLISH, ii)
+      if en_id == -1:
         continue
       for jj in de.words():
-        if not jj in vocab[1]:
+        de_id = vocab.get_id(GERMAN, jj)
+        if de_id == -1:
           continue
-        if vocab[1][jj] % 100 == 0:
+        if de_id % 100 == 0:
           print "DICT", jj, ii
-        trans[vocab[1][jj]].add(vocab[0][ii])
+        trans[de_id].add(en_id)
 
   o = open(flags.output, 'w')
-  vocab_size = [max(vocab[x].values()) + 1 for x in vocab]
+  vocab_size = [1 + max(vocab.get_id(x, y) for y in vocab.words(x))
+                for x in [ENGLISH, GERMAN]]
   for jj in xrange(vocab_size[1]):
     sum = 0.0
     for ii in xrange(vocab_size[0]):
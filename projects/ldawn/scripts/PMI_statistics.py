@@ -1,9 +1,15 @@
+from array import array
 from collections import defaultdict
+import numpy
 from nltk.probability import FreqDist
 from glob import glob
 from math import log
 from topicmod.corpora.proto.corpus_pb2 import *
 from topicmod.corpora.proto.wordnet_file_pb2 import *
+from topicmod.corpora.proto_corpus import read_section, latest_vocab, \
+    section_documents
+from statistics_store import StatisticsStore, has_statistics_store
+from cooccurrence import DocumentCooccurrence
 
 SMOOTH_FACTOR = 0.01
 
@@ -144,22 +150,21 @@ def get_statistics(corpus_dir, model_dir, topics,
   if train_only:
     doc_id = open(model_dir + '.doc_id', 'r')
 
+  # whole-document co-occurrence is a sparse matrix product, not a loop over
+  # every pair of positions
+  if window_size == -1:
+    doc_cooccur = DocumentCooccurrence(topic_word_set)
+
   doc_num = 0
   for ii in glob("%s/*.index" % corpus_dir):
-    inputfile = open(ii, 'rb')
-    protocorpus = Corpus()
-    protocorpus.ParseFromString(inputfile.read())
+    protocorpus = read_section(ii)
 
-    for dd in protocorpus.doc_filenames:
+    for dd, doc in section_documents(corpus_dir, ii, protocorpus):
 
       doc_num += 1
       if doc_num % 1000 == 0:
         print "Finished reading", doc_num, "documents."
 
-      docfile = open("%s/%s" % (corpus_dir, dd), 'rb')
-      doc = Document()
-      doc.ParseFromString(docfile.read())
-
       if train_only:
         doc_id_line = doc_id.readline()
         is_train = doc_id_line.find('  train/')
@@ -176,15 +181,17 @@ def get_statistics(corpus_dir, model_dir, topics,
             tfidf[kk.token] = kk.tfidf
 
       words_len = len(words)
+      if window_size == -1:
+        doc_cooccur.add_doc(words)
+
       for index1 in range(0, words_len):
         w1 = words[index1]
         if w1 in topic_word_set:
           wordcount[w1] += 1
 
           if window_size == -1:
-            index_end = words_len
-          else:
-            index_end = min(words_len, index1 + window_size)
+            continue
+          index_end = min(words_len, index1 + window_size)
 
           for index2 in range(index1 + 1, index_end):
             w2 = words[index2]
@@ -197,11 +204,13 @@ def get_statistics(corpus_dir, model_dir, topics,
       #if doc_num > 10:
       #  break
 
-    inputfile.close()
-
   if train_only:
     doc_id.close()
 
+  if window_size == -1:
+    for w1, w2, count in doc_cooccur.pairs():
+      cooccur[w1][w2] += count
+
   return cooccur, wordcount, tfidf, doc_num
 
 
@@ -219,49 +228,40 @@ def get_statistics_all(corpus_dir, num_topcis, model_dir,
   tfidf_res = defaultdict()
   topics = defaultdict()
 
-  read_voc = 0
-
   topic_assignments = open(model_dir + '.topic_assignments', 'r')
   doc_id = open(model_dir + '.doc_id', 'r')
 
   doc_num = 0
 
+  # the newest vocab also has the terms of sections added by an append
+  vocab = defaultdict()
+  for lang in latest_vocab(corpus_dir).tokens:
+    for term in lang.terms:
+      vocab[term.id] = term.original
+      cooccur[term.id] = defaultdict()
+      wordcount[term.id] = SMOOTH_FACTOR
+      tfidf[term.id] = 0
+      #tfidf[term.id] = []
+
+  # Initialization
+  for tt in range(0, num_topcis):
+    topics[tt] = FreqDist()
+
+  if window_size == -1:
+    doc_cooccur = DocumentCooccurrence(vocab.keys())
+
+  for w in cooccur.keys():
+    for ww in vocab.keys():
+      cooccur[w][ww] = SMOOTH_FACTOR
+
   for ii in glob("%s/*.index" % corpus_dir):
-    inputfile = open(ii, 'rb')
-    protocorpus = Corpus()
-    protocorpus.ParseFromString(inputfile.read())
-
-    if read_voc == 0:
-      # assume that vocab in each index file is the same, so
-      # we just need to load it once and initialize index once
-      # or it is too slow
-      read_voc = 1
-      vocab = defaultdict()
-      for lang in protocorpus.tokens:
-        for ii in lang.terms:
-          vocab[ii.id] = ii.original
-          cooccur[ii.id] = defaultdict()
-          wordcount[ii.id] = SMOOTH_FACTOR
-          tfidf[ii.id] = 0
-          #tfidf[ii.id] = []
-
-      # Initialization
-      for tt in range(0, num_topcis):
-        topics[tt] = FreqDist()
-
-      for w in cooccur.keys():
-        for ww in vocab.keys():
-          cooccur[w][ww] = SMOOTH_FACTOR
-
-    for dd in protocorpus.doc_filenames:
+    protocorpus = read_section(ii)
+
+    for dd, doc in section_documents(corpus_dir, ii, protocorpus):
       doc_num += 1
       if doc_num % 1000 == 0:
         print "Finished reading", doc_num, "documents."
 
-      docfile = open("%s/%s" % (corpus_dir, dd), 'rb')
-      doc = Document()
-      doc.ParseFromString(docfile.read())
-
       topic_line = topic_assignments.readline()
       assign = topic_line.split(' ')
       # the first one is the number of words, not topic assignments
@@ -291,14 +291,16 @@ def get_statistics_all(corpus_dir, num_topcis, model_dir,
           words.append(kk.token)
 
       words_len = len(words)
+      if window_size == -1:
+        doc_cooccur.add_doc(words)
+
       for index1 in range(0, words_len):
         w1 = words[index1]
         wordcount[w1] += 1
 
         if window_size == -1:
-          index_end = words_len
-        else:
-          index_end = min(words_len, index1 + window_size)
+          continue
+        index_end = min(words_len, index1 + window_size)
 
         for index2 in range(index1 + 1, index_end):
           w2 = words[index2]
@@ -310,11 +312,13 @@ def get_statistics_all(corpus_dir, num_topcis, model_dir,
       #if doc_num > 10:
       #  break
 
-    inputfile.close()
-
   topic_assignments.close()
   doc_id.close()
 
+  if window_size == -1:
+    for w1, w2, count in doc_cooccur.pairs():
+      cooccur[w1][w2] += count
+
   for ww in tfidf.keys():
     if tfidf[ww] > 0:
       # max
@@ -351,59 +355,125 @@ def get_statistics_all(corpus_dir, num_topcis, model_dir,
   return cooccur, wordcount, tfidf_res, vocab, topics_top, doc_num
 
 
+# streaming summary of the tfidf of each word in a fixed 64 bytes: count,
+# sum and max, and for the median the five markers of the P-squared
+# estimator (Jain and Chlamtac), which is exact for words seen no more than
+# five times
+class TfidfSummary:
+
+  # where the markers should be, as fractions of the values seen so far
+  MARKERS = [0.0, 0.25, 0.5, 0.75, 1.0]
+
+  def __init__(self, vocab_size):
+    self._count = [0] * vocab_size
+    self._sum = [0] * vocab_size
+    self._max = [0] * vocab_size
+    # marker heights (five per word) and the positions of the middle three
+    self._height = array('d', [0.0]) * (5 * vocab_size)
+    self._position = array('d', [0.0]) * (3 * vocab_size)
+
+  def add(self, word, value):
+    self._count[word] += 1
+    self._sum[word] += value
+    if value > self._max[word]:
+      self._max[word] = value
+
+    count = self._count[word]
+    q = self._height
+    base = 5 * word
+    if count <= 5:
+      # the first five values, kept sorted, are the initial markers
+      index = base + count - 1
+      while index > base and q[index - 1] > value:
+        q[index] = q[index - 1]
+        index -= 1
+      q[index] = value
+      if count == 5:
+        self._position[3 * word:3 * word + 3] = array('d', [2.0, 3.0, 4.0])
+      return
+
+    # positions of the five markers (the ends are the first and the count)
+    n = [1.0] + list(self._position[3 * word:3 * word + 3]) + [count - 1.0]
+    h = list(q[base:base + 5])
+    if value < h[0]:
+      h[0] = value
+      k = 0
+    elif value >= h[4]:
+      h[4] = value
+      k = 3
+    else:
+      k = 0
+      while value >= h[k + 1]:
+        k += 1
+    for ii in xrange(k + 1, 5):
+      n[ii] += 1
+
+    for ii in xrange(1, 4):
+      d = 1 + (count - 1) * self.MARKERS[ii] - n[ii]
+      if (d >= 1 and n[ii + 1] - n[ii] > 1) or \
+            (d <= -1 and n[ii - 1] - n[ii] < -1):
+        d = 1 if d > 0 else -1
+        # parabolic prediction, or linear if that leaves the neighbors
+        height = h[ii] + d / (n[ii + 1] - n[ii - 1]) * \
+            ((n[ii] - n[ii - 1] + d) * (h[ii + 1] - h[ii]) /
+             (n[ii + 1] - n[ii]) +
+             (n[ii + 1] - n[ii] - d) * (h[ii] - h[ii - 1]) /
+             (n[ii] - n[ii - 1]))
+        if not h[ii - 1] < height < h[ii + 1]:
+          height = h[ii] + d * (h[ii + d] - h[ii]) / (n[ii + d] - n[ii])
+        h[ii] = height
+        n[ii] += d
+
+    q[base:base + 5] = array('d', h)
+    self._position[3 * word:3 * word + 3] = array('d', n[1:4])
+
+  def words(self):
+    return [x for x in xrange(len(self._count)) if self._count[x] > 0]
+
+  def mean(self, word):
+    return self._sum[word] / self._count[word]
+
+  def max(self, word):
+    return self._max[word]
+
+  def median(self, word):
+    count = self._count[word]
+    if count < 5:
+      return self._height[5 * word + count / 2]
+    return self._height[5 * word + 2]
+
+
 # read tfidf of vocab words
 def get_tfidf(proto_corpus_dir, vocab_file, output_dir):
 
-  tfidf = defaultdict()
-
   [vocab_word_index, vocab_index_word] = readVocab(vocab_file)
 
+  # words that appear more than once in the vocab share their last index
+  canonical = [vocab_word_index[x] for x in vocab_index_word]
+  tfidf = TfidfSummary(len(vocab_index_word))
+
   doc_num = 0
   for ii in glob("%s/*.index" % proto_corpus_dir):
-    inputfile = open(ii, 'rb')
-    protocorpus = Corpus()
-    protocorpus.ParseFromString(inputfile.read())
+    protocorpus = read_section(ii)
 
-    for dd in protocorpus.doc_filenames:
+    for dd, doc in section_documents(proto_corpus_dir, ii, protocorpus):
       doc_num += 1
       if doc_num % 1000 == 0:
         print "Finished reading", doc_num, "documents."
 
-      docfile = open("%s/%s" % (proto_corpus_dir, dd), 'rb')
-      doc = Document()
-      doc.ParseFromString(docfile.read())
-
       for jj in doc.sentences:
         for kk in jj.words:
-          word = vocab_index_word[kk.token]
-          # print word
-          if word not in tfidf.keys():
-            tfidf[word] = []
-          
-          tfidf[word].append(kk.tfidf)
-
-    inputfile.close()
+          tfidf.add(canonical[kk.token], kk.tfidf)
 
   tfidf_mean_output = open(output_dir + "/tfidf_mean.txt", 'w')
   tfidf_max_output = open(output_dir + "/tfidf_max.txt", 'w')
   tfidf_mid_output = open(output_dir + "/tfidf_mid.txt", 'w')
-  
-  for ww in tfidf.keys():
-    tmp_max = 0
-    tmp_mean = 0
-    for val in tfidf[ww]:
-      if val > tmp_max:
-        tmp_max = val
-      tmp_mean += val
-    tmp_mean = tmp_mean / len(tfidf[ww])
-    
-    tmp = tfidf[ww].sort()
-    index = int(len(tfidf[ww]) / 2)
-    tmp_mid = tfidf[ww][index]
-    
-    tfidf_mean_output.write(ww + "\t" + str(tmp_mean) + "\n")
-    tfidf_max_output.write(ww + "\t" + str(tmp_max) + "\n")
-    tfidf_mid_output.write(ww + "\t" + str(tmp_mid) + "\n")
+
+  for ii in tfidf.words():
+    ww = vocab_index_word[ii]
+    tfidf_mean_output.write(ww + "\t" + str(tfidf.mean(ii)) + "\n")
+    tfidf_max_output.write(ww + "\t" + str(tfidf.max(ii)) + "\n")
+    tfidf_mid_output.write(ww + "\t" + str(tfidf.median(ii)) + "\n")
 
   tfidf_mean_output.close()
   tfidf_max_output.close()
@@ -411,6 +481,9 @@ def get_tfidf(proto_corpus_dir, vocab_file, output_dir):
 
 
 def readStatistics(input_dir, topic_vocab, vocab_size):
+  if has_statistics_store(input_dir):
+    return readStatisticsStore(input_dir, topic_vocab, vocab_size)
+
   wordcount = defaultdict()
   cooccur = defaultdict()
   tfidf = defaultdict()
@@ -437,7 +510,7 @@ def readStatistics(input_dir, topic_vocab, vocab_size):
   for line in infile:
     line = line.strip()
     words = line.split('\t')
-    if words[0] in wordcount.keys():
+    if words[0] in wordcount:
       wordcount[words[0]] += int(words[1])
     wordcount_total += int(words[1])
   infile.close()
@@ -448,7 +521,7 @@ def readStatistics(input_dir, topic_vocab, vocab_size):
   for line in infile:
     line = line.strip()
     words = line.split('\t')
-    if words[0] in cooccur.keys() and words[1] in cooccur.keys():
+    if words[0] in cooccur and words[1] in cooccur:
       cooccur[words[0]][words[1]] += int(words[2])
     cooccur_total += int(words[2])
   infile.close()
@@ -461,10 +534,95 @@ def readStatistics(input_dir, topic_vocab, vocab_size):
   for line in infile:
     line = line.strip()
     words = line.split('\t')
-    if words[0] in tfidf.keys():
+    if words[0] in tfidf:
       tfidf[words[0]] = float(words[1])
   infile.close()
 
   return cooccur, cooccur_total, tfidf, wordcount, wordcount_total
 
 
+# same as readStatistics, but only reads the rows of the topic words from the
+# binary store written by write_statistics_store
+def readStatisticsStore(input_dir, topic_vocab, vocab_size):
+  store = StatisticsStore(input_dir)
+
+  words = sorted(topic_vocab)
+  ids = store.word_ids(words)
+  counts = store.wordcount(ids)
+  max_tfidf = store.tfidf(ids, "max")
+  pairs = store.cooccurrence(ids)
+
+  wordcount = defaultdict()
+  cooccur = defaultdict()
+  tfidf = defaultdict()
+  for ii, w1 in enumerate(words):
+    tfidf[w1] = float(max_tfidf[ii])
+    wordcount[w1] = SMOOTH_FACTOR + int(counts[ii])
+    cooccur[w1] = defaultdict()
+    for jj in xrange(ii + 1, len(words)):
+      cooccur[w1][words[jj]] = SMOOTH_FACTOR + int(pairs[ii, jj])
+
+  wordcount_total = SMOOTH_FACTOR * vocab_size + store.wordcount_total
+  cooccur_total = SMOOTH_FACTOR * vocab_size * (vocab_size - 1) / 2 + \
+      store.cooccur_total
+
+  print "all: ", wordcount_total, cooccur_total
+
+  return cooccur, cooccur_total, tfidf, wordcount, wordcount_total
+
+
+
+
+# the statistics of a list of words as arrays in that order: the smoothed
+# co-occurrence counts as a symmetric matrix, plus the max tfidf and smoothed
+# count of each word
+def readStatisticsMatrix(input_dir, words, vocab_size):
+  if has_statistics_store(input_dir):
+    store = StatisticsStore(input_dir)
+    ids = store.word_ids(words)
+    cooccur = SMOOTH_FACTOR + store.cooccurrence(ids)
+    wordcount = SMOOTH_FACTOR + store.wordcount(ids)
+    tfidf = store.tfidf(ids, "max")
+    wordcount_total = SMOOTH_FACTOR * vocab_size + store.wordcount_total
+    cooccur_total = SMOOTH_FACTOR * vocab_size * (vocab_size - 1) / 2 + \
+        store.cooccur_total
+  else:
+    [cooccur_dict, cooccur_total, tfidf_dict, wordcount_dict,
+     wordcount_total] = readStatistics(input_dir, set(words), vocab_size)
+    size = len(words)
+    cooccur = numpy.zeros((size, size))
+    for ii in xrange(size):
+      for jj in xrange(size):
+        if words[ii] < words[jj]:
+          cooccur[ii, jj] = cooccur_dict[words[ii]][words[jj]]
+          cooccur[jj, ii] = cooccur[ii, jj]
+    wordcount = numpy.array([wordcount_dict[x] for x in words])
+    tfidf = numpy.array([tfidf_dict[x] for x in words])
+
+  return cooccur, cooccur_total, tfidf, wordcount, wordcount_total
+
+
+# computePMI (or computePMI2 if squared) for every pair of words at once
+def computePMIMatrix(cooccur, cooccur_total, wordcount, wordcount_total,
+                     squared=False):
+  cooccur = numpy.asarray(cooccur, dtype=float)
+  wordcount = numpy.asarray(wordcount, dtype=float)
+  if squared:
+    pmi = cooccur * cooccur * wordcount_total * wordcount_total \
+        / cooccur_total / cooccur_total
+  else:
+    pmi = cooccur * wordcount_total * wordcount_total / cooccur_total
+  pmi /= numpy.outer(wordcount, wordcount)
+  numpy.fill_diagonal(pmi, 0.0)
+  return pmi
+
+
+# the mean pairwise score of each topic; membership has a row for each topic
+# with a 1 in the column of each of its words (all distinct)
+def topicCoherence(pmi, membership):
+  membership = numpy.asarray(membership, dtype=float)
+  totals = ((membership.dot(pmi)) * membership).sum(axis=1) / 2.0
+  sizes = membership.sum(axis=1)
+  num_pairs = sizes * (sizes - 1) / 2
+  scores = totals / numpy.maximum(num_pairs, 1)
+  return scores, num_pairs.astype(int)
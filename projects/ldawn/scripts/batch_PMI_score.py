@@ -0,0 +1,80 @@
+import numpy
+from topicmod.util import flags
+from PMI_statistics import *
+
+TOPICS_EXTENSION = ".topics"
+
+
+# score the topics of many models (e.g. every round of every variant) with
+# the statistics of the words of all of them read at once
+def batch_PMI_score(stats, models, topics_cutoff, vocab_size, output):
+  model_topics = []
+  all_words = set()
+  for model in models:
+    [topics, topic_word_set] = readTopics(model, topics_cutoff)
+    model_topics.append(topics)
+    all_words |= topic_word_set
+
+  words = sorted(all_words)
+  index = dict((x, ii) for ii, x in enumerate(words))
+  print "Reading statistics of", len(words), "words for", len(models), \
+      "models"
+  [cooccur, cooccur_total, tfidf, wordcount, wordcount_total] \
+      = readStatisticsMatrix(stats, words, vocab_size)
+
+  pmi = computePMIMatrix(cooccur, cooccur_total, wordcount, wordcount_total)
+  pmi2 = computePMIMatrix(cooccur, cooccur_total, wordcount, wordcount_total,
+                          True)
+
+  # one row per topic of every model
+  rows = []
+  model_rows = []
+  for model, topics in zip(models, model_topics):
+    start = len(rows)
+    for tt in sorted(topics.keys()):
+      rows.append((tt, [index[x] for x in topics[tt]]))
+    model_rows.append(range(start, len(rows)))
+  membership = numpy.zeros((len(rows), len(words)))
+  for ii, (tt, topic_words) in enumerate(rows):
+    membership[ii, topic_words] = 1
+
+  [pmi_scores, num_pairs] = topicCoherence(pmi, membership)
+  [pmi2_scores, num_pairs] = topicCoherence(pmi2, membership)
+
+  outfile = open(output, 'w')
+  outfile.write("model\ttopic\tpairs\tPMI\tPMI2\n")
+  for model, selected in zip(models, model_rows):
+    for ii in selected:
+      outfile.write("%s\t%i\t%i\t%s\t%s\n" % (model, rows[ii][0],
+                                              num_pairs[ii],
+                                              str(pmi_scores[ii]),
+                                              str(pmi2_scores[ii])))
+    if selected:
+      outfile.write("%s\ttotal\t%i\t%s\t%s\n" %
+                    (model, len(selected),
+                     str(pmi_scores[selected].mean()),
+                     str(pmi2_scores[selected].mean())))
+  outfile.close()
+
+
+flags.define_string("vocab", "", "Where we find the vocab")
+flags.define_glob("topics", "", "The .topics files of the models to score")
+flags.define_string("stats", None, "Where we find the stat_file")
+flags.define_int("topics_cutoff", 30, "Number of topic words")
+flags.define_string("output", "output/PMI_scores.txt",
+                    "Where we write the table of scores")
+
+if __name__ == "__main__":
+
+  flags.InitFlags()
+
+  print "Reading vocab"
+  [vocab_word_index, vocab_index_word] = readVocab(flags.vocab)
+  vocab_size = len(vocab_word_index)
+
+  models = sorted(x[:-len(TOPICS_EXTENSION)] for x in flags.topics
+                  if x.endswith(TOPICS_EXTENSION))
+
+  print "Compute PMI scores"
+  batch_PMI_score(flags.stats, models, flags.topics_cutoff, vocab_size,
+                  flags.output)
@@ -0,0 +1,9 @@
+from topicmod.util import flags
+from statistics_store import write_statistics_store
+
+flags.define_string("stats", None,
+                    "Directory of text statistics to convert into a store")
+
+if __name__ == "__main__":
+  flags.InitFlags()
+  write_statistics_store(flags.stats)
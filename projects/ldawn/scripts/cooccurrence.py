@@ -0,0 +1,236 @@
+"""
+Counting how often vocabulary words appear, and appear near each other, in a
+reference corpus.
+
+Words get ids in sorted order, so a pair (w1, w2) with w1 < w2 is stored in
+row id(w1), column id(w2) of an upper-triangular sparse matrix.  Pairs are
+found with NumPy a document at a time and buffered until there are enough of
+them to add to the matrix, so memory grows with the number of distinct pairs
+seen rather than with the square of the vocabulary.
+"""
+
+import os
+
+import numpy
+from scipy.sparse import coo_matrix, csr_matrix
+
+COUNT_TYPE = numpy.int64
+
+
+class CooccurrenceCounter:
+
+  def __init__(self, words, window_size, batch_size=5000000):
+    self._words = sorted(set(words))
+    self._ids = dict((x, ii) for ii, x in enumerate(self._words))
+    self._window_size = window_size
+    self._batch_size = batch_size
+
+    size = len(self._words)
+    self._wordcount = numpy.zeros(size, dtype=COUNT_TYPE)
+    self._cooccur = csr_matrix((size, size), dtype=COUNT_TYPE)
+    self._pending = []
+    self._num_pending = 0
+
+  def __len__(self):
+    return len(self._words)
+
+  def words(self):
+    return self._words
+
+  def token_ids(self, tokens):
+    """
+    The id of each token, -1 if it isn't in the vocab
+    """
+    return numpy.fromiter((self._ids.get(x, -1) for x in tokens),
+                          dtype=numpy.int32, count=len(tokens))
+
+  def add_tokens(self, tokens):
+    self.add_ids(self.token_ids(tokens))
+
+  def add_ids(self, ids):
+    """
+    Count a document given as an array of token ids (-1 for words outside
+    the vocab, which still take up space in the window)
+    """
+    ids = numpy.asarray(ids)
+    known = ids[ids >= 0]
+    if len(known) == 0:
+      return
+    counts = numpy.bincount(known)
+    self._wordcount[:len(counts)] += counts
+
+    if self._window_size == -1:
+      # Every pair of positions in the document: a pair of distinct words
+      # co-occurs count(w1) * count(w2) times
+      present = numpy.flatnonzero(counts)
+      first, second = numpy.triu_indices(len(present), 1)
+      self.add_pairs(present[first], present[second],
+                     counts[present[first]] * counts[present[second]])
+    else:
+      # Pairs of positions less than window_size apart
+      for offset in xrange(1, min(self._window_size, len(ids))):
+        left = ids[:-offset]
+        right = ids[offset:]
+        keep = (left >= 0) & (right >= 0) & (left != right)
+        left = left[keep]
+        right = right[keep]
+        self.add_pairs(numpy.minimum(left, right),
+                       numpy.maximum(left, right))
+
+  def add_pairs(self, rows, cols, counts=None):
+    if len(rows) == 0:
+      return
+    if counts is None:
+      counts = numpy.ones(len(rows), dtype=COUNT_TYPE)
+    self._pending.append((rows, cols, counts))
+    self._num_pending += len(rows)
+    if self._num_pending > self._batch_size:
+      self.flush()
+
+  def flush(self):
+    """
+    Add the buffered pairs to the sparse matrix
+    """
+    if not self._pending:
+      return
+    rows = numpy.concatenate([x[0] for x in self._pending])
+    cols = numpy.concatenate([x[1] for x in self._pending])
+    counts = numpy.concatenate([x[2] for x in self._pending])
+    size = len(self._words)
+    batch = coo_matrix((counts.astype(COUNT_TYPE), (rows, cols)),
+                       shape=(size, size)).tocsr()
+    self._cooccur = self._cooccur + batch
+    self._pending = []
+    self._num_pending = 0
+
+  def wordcount(self):
+    return self._wordcount
+
+  def cooccurrence(self):
+    """
+    The upper-triangular CSR matrix of pair counts
+    """
+    self.flush()
+    return self._cooccur
+
+  def save(self, filename, num_docs=0):
+    """
+    Write the counts to a .npz file; it is renamed into place once complete,
+    so a file that exists is never half written
+    """
+    cooccur = self.cooccurrence().tocoo()
+    outfile = open(filename + ".tmp", 'wb')
+    numpy.savez(outfile, wordcount=self._wordcount, rows=cooccur.row,
+                cols=cooccur.col, counts=cooccur.data,
+                num_docs=numpy.array([num_docs]))
+    outfile.close()
+    os.rename(filename + ".tmp", filename)
+
+  def merge(self, filename):
+    """
+    Add the counts written by save (with the same vocab) to these; returns
+    the number of documents they came from
+    """
+    part = numpy.load(filename)
+    assert len(part["wordcount"]) == len(self._words), \
+        "%s was counted with a different vocab" % filename
+    self._wordcount += part["wordcount"]
+    self.add_pairs(part["rows"], part["cols"], part["counts"])
+    num_docs = int(part["num_docs"][0])
+    part.close()
+    return num_docs
+
+  def write_text(self, output_dir):
+    """
+    Write wordcount.txt (every vocab word and its count) and cooccurance.txt
+    (w1, w2 and their count for every pair with w1 < w2 that was seen)
+    """
+    outfile = open(output_dir + "/wordcount.txt", 'w')
+    for word, count in zip(self._words, self._wordcount):
+      outfile.write("%s\t%i\n" % (word, count))
+    outfile.close()
+
+    cooccur = self.cooccurrence()
+    cooccur.sort_indices()
+    outfile = open(output_dir + "/cooccurance.txt", 'w')
+    for ii, w1 in enumerate(self._words):
+      start, end = cooccur.indptr[ii], cooccur.indptr[ii + 1]
+      for jj, count in zip(cooccur.indices[start:end],
+                           cooccur.data[start:end]):
+        if count != 0:
+          outfile.write("%s\t%s\t%i\n" % (w1, self._words[jj], count))
+    outfile.close()
+
+
+class DocumentCooccurrence:
+  """
+  Whole-document co-occurrence of a set of words: how many pairs of
+  positions in the same document hold the two words.  For a block of
+  documents that is X^T X, where X counts how often each word appears in
+  each document, so the documents are added a block at a time and only the
+  block's X is ever in memory.
+  """
+
+  def __init__(self, words, block_size=10000):
+    self._words = sorted(set(words))
+    self._ids = dict((x, ii) for ii, x in enumerate(self._words))
+    self._block_size = block_size
+
+    size = len(self._words)
+    self._cooccur = csr_matrix((size, size), dtype=COUNT_TYPE)
+    self._rows = []
+    self._cols = []
+    self._counts = []
+    self._block_docs = 0
+
+  def add_doc(self, tokens):
+    counts = {}
+    for ii in tokens:
+      if ii in self._ids:
+        counts[self._ids[ii]] = counts.get(self._ids[ii], 0) + 1
+    for ii in counts:
+      self._rows.append(self._block_docs)
+      self._cols.append(ii)
+      self._counts.append(counts[ii])
+
+    self._block_docs += 1
+    if self._block_docs >= self._block_size:
+      self.flush()
+
+  def flush(self):
+    if self._block_docs == 0:
+      return
+    size = len(self._words)
+    doc_term = coo_matrix((numpy.array(self._counts, dtype=COUNT_TYPE),
+                           (numpy.array(self._rows, dtype=numpy.int32),
+                            numpy.array(self._cols, dtype=numpy.int32))),
+                          shape=(self._block_docs, size)).tocsr()
+    product = (doc_term.T * doc_term).tocoo()
+
+    # Only the pairs of different words, once each
+    upper = product.row < product.col
+    self._cooccur = self._cooccur + \
+        coo_matrix((product.data[upper],
+                    (product.row[upper], product.col[upper])),
+                   shape=(size, size)).tocsr()
+
+    self._rows = []
+    self._cols = []
+    self._counts = []
+    self._block_docs = 0
+
+  def cooccurrence(self):
+    """
+    The upper-triangular CSR matrix of pair counts (words in sorted order)
+    """
+    self.flush()
+    return self._cooccur
+
+  def pairs(self):
+    """
+    Iterate over (w1, w2, count) with w1 < w2 for every pair that occurs
+    """
+    cooccur = self.cooccurrence().tocoo()
+    for ii, jj, count in zip(cooccur.row, cooccur.col, cooccur.data):
+      if count != 0:
+        yield self._words[ii], self._words[jj], int(count)
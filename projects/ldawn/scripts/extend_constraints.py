@@ -1,9 +1,13 @@
 from hcluster import pdist, linkage, dendrogram
 from numpy import *
+import os
 import re
+from hashlib import md5
 from numpy.random import rand
 from topicmod.util import flags
+from topicmod.util.sets import read_pickle, write_pickle
 from PMI_statistics import *
+from statistics_store import statistics_version
 
 
 def findTopics(topics, cons_file_name):
@@ -31,29 +35,64 @@ def findTopics(topics, cons_file_name):
   return topic_tmp[0], cons_words
 
 
-def getPairDist(cooccur, cooccur_total, wordcount, wordcount_total, topic_words):
+# cooccur and wordcount are the statistics of the words of word_list in that
+# order; returns the condensed distance vector (1 / PMI2 of each pair, in
+# the order pdist uses)
+def getPairDist(cooccur, cooccur_total, wordcount, wordcount_total, word_list):
 
-  tmp_words = topic_words
+  pmi = computePMIMatrix(cooccur, cooccur_total, wordcount, wordcount_total,
+                         True)
+  rows, cols = triu_indices(len(word_list), 1)
+  p_dist = 1.0 / pmi[rows, cols]
 
-  word_list = list(tmp_words)
-  sz = len(word_list) * (len(word_list) - 1) / 2
-  p_dist = zeros(sz, float)
+  return p_dist, word_list
 
-  index = -1
-  for ii in range(len(word_list)):
-    for jj in range(ii+1, len(word_list)):
-      w1 = word_list[ii]
-      w2 = word_list[jj]
-      if w1 < w2:
-        pmi = computePMI2(cooccur[w1][w2], cooccur_total, wordcount[w1], wordcount[w2], wordcount_total)
-      else:
-        pmi = computePMI2(cooccur[w2][w1], cooccur_total, wordcount[w1], wordcount[w2], wordcount_total)
-      index += 1
-      p_dist[index] = 1.0 / pmi
 
-  print p_dist
+# parent[node] is the cluster that node is merged into (-1 for the root);
+# leaves are 0 .. n - 1 and the cluster made at step ii is n + ii
+def findParents(Z, leaves_num):
+  parent = -ones(2 * leaves_num - 1, int)
+  for step in range(len(Z)):
+    parent[int(Z[step][0])] = leaves_num + step
+    parent[int(Z[step][1])] = leaves_num + step
+  return parent
+
+
+# the clustering of a topic's words: (word_list, p_dist, Z, parent).  With a
+# cache_dir it is kept there, keyed by the words and the version of the
+# statistics, so the same topic is only clustered once.
+def topicClustering(stats, vocab_size, topic_words, cache_dir=None):
+
+  word_list = sorted(topic_words)
+  version = "%s\t%i" % (statistics_version(stats), vocab_size)
+  key = md5("\t".join(word_list) + "\n" + version).hexdigest()
+  cache_file = None
+  if cache_dir:
+    cache_file = "%s/%s.pkl" % (cache_dir, key)
+    if os.path.exists(cache_file):
+      print "Using cached clustering", cache_file
+      return read_pickle(cache_file)
 
-  return p_dist, word_list
+  [cooccur, cooccur_total, tfidf, wordcount, wordcount_total] \
+                          = readStatisticsMatrix(stats, word_list, vocab_size)
+  [p_dist, word_list] = getPairDist(cooccur, cooccur_total, wordcount, \
+                                    wordcount_total, word_list)
+  Z = linkage(p_dist)
+  parent = findParents(Z, len(word_list))
+
+  clustering = (word_list, p_dist, Z, parent)
+  if cache_file:
+    if not os.path.exists(cache_dir):
+      os.makedirs(cache_dir)
+    write_pickle(clustering, cache_file)
+  return clustering
+
+
+def pathFromParents(parent, index):
+  word_path = [index]
+  while parent[word_path[-1]] != -1:
+    word_path.append(parent[word_path[-1]])
+  return word_path
 
 
 def findPath(Z, index, leaves_num):
@@ -93,20 +132,14 @@ def findCluster(Z, cluster_root, word_list):
   return merge
 
 
-def hierarchicalClustering(p_dist, word_list, cons_words):
-
-  Z = linkage(p_dist)
+def hierarchicalClustering(Z, parent, word_list, cons_words):
 
   index1 = word_list.index(cons_words[0])
   assert index1 >= 0
-  path1 = findPath(Z, index1, len(word_list))
+  path1 = pathFromParents(parent, index1)
   index2 = word_list.index(cons_words[1])
   assert index2 >= 0  
-  path2 = findPath(Z, index2, len(word_list))
-
-  print Z
-  print path1
-  print path2
+  path2 = pathFromParents(parent, index2)
 
   common = set(path1).intersection(set(path2))
   # at least have the common root
@@ -127,11 +160,13 @@ def hierarchicalClustering(p_dist, word_list, cons_words):
   return split_pair, merge1, merge2
 
 
-def extentCons(cooccur, cooccur_total, wordcount, wordcount_total, topic, cons_words):
+def extentCons(stats, vocab_size, topic, cons_words, cache_dir=None):
 
-  [p_dist, word_list] = getPairDist(cooccur, cooccur_total, wordcount, wordcount_total, topic)
+  [word_list, p_dist, Z, parent] = topicClustering(stats, vocab_size, topic, \
+                                                   cache_dir)
 
-  [split_pair, merge1, merge2] = hierarchicalClustering(p_dist, word_list, cons_words)
+  [split_pair, merge1, merge2] = hierarchicalClustering(Z, parent, word_list, \
+                                                        cons_words)
 
   return split_pair, merge1, merge2
 
@@ -203,6 +238,8 @@ flags.define_string("stats", None, "Where we find the stat_file")
 flags.define_string("model", "", "The model files folder of topic models")
 flags.define_string("constraint", "constraints/tmp", "Original constraint file")
 flags.define_int("topics_cutoff", 30, "Number of topic words")
+flags.define_string("cluster_cache", None,
+                    "Where we keep the clustering of each topic between runs")
 
 if __name__ == "__main__":
 
@@ -221,13 +258,9 @@ if __name__ == "__main__":
   print "Find the splitting topic"
   [tt, cons_words] = findTopics(topics, flags.constraint)
 
-  print "Reading statistics"
-  [cooccur, cooccur_total, tfidf, wordcount, wordcount_total] \
-                          = readStatistics(flags.stats, topics[tt], vocab_size)
-
   print "Generating the links"
-  [split_pair, merge1, merge2] = extentCons(cooccur, cooccur_total, wordcount, \
-                                 wordcount_total, topics[tt], cons_words)
+  [split_pair, merge1, merge2] = extentCons(flags.stats, vocab_size, \
+                                 topics[tt], cons_words, flags.cluster_cache)
 
   print "Writing links to file"
   write_links(split_pair, merge1, merge2, flags.constraint + ".ext")
@@ -1,53 +1,62 @@
 from collections import defaultdict
 from math import log
+import numpy
 from topicmod.util import flags
 from PMI_statistics import *
 
 
-def generate_links_PMI(cooccur, cN, tfidf, tfidf_thresh, topics,\
-                       wordcount, wN):
+# the (row, col) of the masked entries with the largest values, most first
+# (ties in row, col order), at most limit of them
+def top_pairs(values, mask, limit):
+  rows, cols = numpy.nonzero(mask)
+  scores = values[rows, cols]
+  if limit <= 0:
+    return []
 
+  if limit < len(scores):
+    # partial sort: only keep what can make the cut
+    kth = numpy.partition(scores, len(scores) - limit)[len(scores) - limit]
+    keep = scores >= kth
+    rows, cols, scores = rows[keep], cols[keep], scores[keep]
+
+  order = numpy.lexsort((cols, rows, -scores))[:limit]
+  return zip(rows[order], cols[order])
+
+
+# words are the topic words in sorted order, and cooccur, tfidf and wordcount
+# are their statistics in that order
+def generate_links_PMI(words, cooccur, cN, tfidf, tfidf_thresh, topics, \
+                       wordcount, wN, cannot_links_num, must_links_num):
+
+  index = dict((x, ii) for ii, x in enumerate(words))
+  membership = numpy.zeros((len(topics), len(words)))
+  for row, tt in enumerate(sorted(topics.keys())):
+    membership[row, [index[x] for x in topics[tt]]] = 1
+
+  # shared[w1, w2] is the number of topics with both words
+  shared = membership.T.dot(membership)
+  in_topics = shared.diagonal()
+
+  pmi = computePMIMatrix(cooccur, cN, wordcount, wN)
+  above = tfidf > tfidf_thresh
+  candidates = numpy.triu(numpy.outer(above, above) & (cooccur > 0), 1)
+
+  # Generate cannot links
+  # If two words with very low cooccur appearing in the same topic
+  # We should add a cannot link
   cannot = FreqDist()
+  for w1, w2 in top_pairs(-pmi, candidates & (shared > 0), cannot_links_num):
+    cannot[(words[w1], words[w2])] = float(-pmi[w1, w2])
+
+  # Generate must links
+  # If two words with very high cooccur appearing in the different topics
+  # (a topic with the first but not the second, and another with the second
+  # but not the first) We should add a must link
+  different = (in_topics[:, numpy.newaxis] > shared) & \
+      (in_topics[numpy.newaxis, :] > shared)
   must = FreqDist()
-
-  for tt in topics.keys():
-
-    #tmp_words = set(topics[tt].keys())
-    tmp_words = topics[tt]
-
-    # Generate cannot links
-    # If two words with very low cooccur appearing in the same topic
-    # We should add a cannot link
-
-    word_pairs = get_word_pairs(tmp_words, tmp_words)
-    for (w1, w2) in word_pairs:
-      if cooccur[w1][w2] > 0 and tfidf[w1] > tfidf_thresh \
-                             and tfidf[w2] > tfidf_thresh:
-        pmi = computePMI(cooccur[w1][w2], cN, wordcount[w1], wordcount[w2], wN)
-        value = -1 * pmi
-        cannot[(w1, w2)] = value
-
-    # Generate must links
-    # If two words with very high cooccur appearing in the different topics
-    # We should add a must link
-    topic_words = set()
-    for tt_other in topics.keys():
-      if tt_other != tt:
-        # other_words = set(topics[tt_other].keys())
-        other_words = topics[tt_other]
-        shared = other_words.intersection(tmp_words)
-        other_remained = other_words.difference(shared)
-        tmp_remained = tmp_words.difference(shared)
-        # print len(other_words), len(other_remained), \
-        #  len(shared), len(tmp_words), len(tmp_remained)
-
-        word_pairs = get_word_pairs(tmp_remained, other_remained)
-        for (w1, w2) in word_pairs:
-          if cooccur[w1][w2] > 0 and tfidf[w1] > tfidf_thresh \
-                                 and tfidf[w2] > tfidf_thresh:
-            pmi = computePMI(cooccur[w1][w2], cN, wordcount[w1], wordcount[w2], wN)
-            value = pmi
-            must[(w1, w2)] = value
+  for w1, w2 in top_pairs(pmi, candidates & different, must_links_num):
+    must[(words[w1], words[w2])] = float(pmi[w1, w2])
 
   return cannot, must
 
@@ -114,12 +123,15 @@ if __name__ == "__main__":
   #                    topics, topic_word_set, flags.window_size, flags.train_only)
 
   print "Reading statistics"
+  words = sorted(topic_word_set)
   [cooccur, cooccur_total, tfidf, wordcount, wordcount_total] \
-                           = readStatistics(flags.stats, topic_word_set, vocab_size)
+                           = readStatisticsMatrix(flags.stats, words, vocab_size)
 
   print "Generating the links"
-  [cannot, must] = generate_links_PMI(cooccur, cooccur_total, tfidf, flags.tfidf_thresh,\
-                                      topics, wordcount, wordcount_total)
+  [cannot, must] = generate_links_PMI(words, cooccur, cooccur_total, tfidf, \
+                                      flags.tfidf_thresh, topics, wordcount, \
+                                      wordcount_total, flags.cannot_links, \
+                                      flags.must_links)
 
   print "Writing links to file"
   write_links(cannot, must, vocab_index_word, flags.cannot_links, flags.must_links, \
@@ -1,28 +1,58 @@
+import os
 from collections import defaultdict
 from glob import glob
+from hashlib import md5
 from math import log
+from multiprocessing import Pool
 from topicmod.util import flags
 from topicmod.ling.snowball_wrapper import Snowball
-import nltk
+from topicmod.ling.resources import punkt
 from nltk.tokenize import wordpunct_tokenize
 from nltk.tokenize import PunktWordTokenizer
 from PMI_statistics import get_tfidf
+from cooccurrence import CooccurrenceCounter
+from statistics_store import write_statistics_store
+
+SHARDS_PER_WORKER = 8
+
+
+def part_filename(part_dir, shard):
+  return "%s/part_%05i.npz" % (part_dir, shard)
+
+
+def count_shard(job):
+  """
+  Count the documents in a shard of files (in a worker process) and write
+  the counts to a part file.  Returns the shard, its number of documents and
+  the stems the worker added to the stem cache.
+  """
+  vocab, window_size, wiki, files, part, stem_cache, shard = job
+
+  cp = corpusParser(0, vocab, None, window_size, None, stem_cache)
+  cp.loadVocab()
+  num_docs = cp.parseFiles(files, wiki)
+  cp.saveCounts(part, num_docs)
+  return shard, num_docs, cp.newStems()
 
 
 class corpusParser():
 
 
-  def __init__(self, lang, vocab_dir, corpus_dir, window_size, output_dir):
+  def __init__(self, lang, vocab_dir, corpus_dir, window_size, output_dir,
+               stem_cache=None):
     self._lang = 0
     self._vocab_dir = vocab_dir
     self._corpus_dir = corpus_dir
     self._window_size = window_size
     self._output_dir = output_dir
     self._stemmer = Snowball()
-    self._sent_tokenizer = nltk.data.load('tokenizers/punkt/english.pickle')
+    # a file of stems kept between runs (and shared with the workers)
+    self._stem_cache = stem_cache
+    if stem_cache and os.path.exists(stem_cache):
+      self._stemmer.load_cache(stem_cache)
+    self._sent_tokenizer = punkt("english")
     self._word_tokenizer = PunktWordTokenizer()
-    self._cooccur = defaultdict()
-    self._wordcount = defaultdict()
+    self._counter = None
     self._vocab = set()
     self._doc_num = 0
     #self._vocab_word_index = defaultdict()
@@ -45,14 +75,8 @@ class corpusParser():
 
     vocabfile.close()
 
-    # Initialize wordcount and cooccur
-    for word in self._vocab:
-      self._wordcount[word] = 0
-      self._cooccur[word] = defaultdict()
-      for word2 in self._vocab:
-        if word2 > word:
-          self._cooccur[word][word2] = 0
-    
+    self._counter = CooccurrenceCounter(self._vocab, self._window_size)
+
 
   def parseDoc(self, doc_raw):
     tokens = []
@@ -60,49 +84,97 @@ class corpusParser():
       for token in self._word_tokenizer.tokenize(sent):
         tokens.append(self._stemmer(self._lang, token))
 
-    tokens_len = len(tokens)
-    for index1 in range(0, tokens_len):
-      w1 = tokens[index1]
-      if w1 in self._vocab:
-        self._wordcount[w1] += 1
+    self._counter.add_tokens(tokens)
 
-        if self._window_size == -1:
-          index_end = tokens_len
-        else:
-          index_end = min(tokens_len, index1 + self._window_size)
 
-        for index2 in range(index1 + 1, index_end):
-          w2 = tokens[index2]
-          if w2 in self._vocab:
-            if w1 < w2:
-              self._cooccur[w1][w2] += 1
-            elif w1 > w2:
-              self._cooccur[w2][w1] += 1
+  def files20news(self):
+    data_folders = [self._corpus_dir + "/train", self._corpus_dir + "/test"]
+    print data_folders
+    files = []
+    for data_folder in data_folders:
+      for folder in glob("%s/*^tgz" % data_folder):
+        files += glob("%s/*" % folder)
+    return files
+
+
+  def filesNyt(self):
+    years = ["1987", "1988", "1989", "1990", "1991", "1992", "1993", "1994", "1995", "1996"]
+
+    files = []
+    for year in years:
+      folder_year = self._corpus_dir + "/" + year
+      for month in glob("%s/[0-9][0-9]" % folder_year):
+        for day in glob("%s" % month):
+          files += glob("%s/*" % day)
+    return files
+
+
+  def filesWiki(self):
+    files = []
+    for folder in glob("%s/*" % self._corpus_dir):
+      files += glob("%s/*" % folder)
+    return files
+
+
+  def corpusFiles(self, option):
+    if option == 0:
+      return self.files20news()
+    elif option == 1:
+      return self.filesWiki()
+    elif option == 2:
+      return self.filesNyt()
+
+
+  def fileDocs(self, ff, wiki):
+    """
+    Iterate over the documents in a file: the whole file, or for wikipedia
+    everything between <doc> and </doc>
+    """
+    infile = open(ff, 'r')
+    if wiki:
+      for line in infile:
+        line = line.strip().lower()
+
+        if line.startswith("<doc"):
+          doc_flag = True
+          doc_raw = ""
+        elif line.startswith("</doc>"):
+          doc_flag = False
+          yield doc_raw
+        else:
+          assert doc_flag == True
+          doc_raw += " " + line
+    else:
+      doc_raw = ""
+      for line in infile:
+        line = line.strip().lower()
+        doc_raw += " " + line
+      yield doc_raw
+    infile.close()
+
+
+  def parseFiles(self, files, wiki):
+    doc_count = 0
+    file_count = 0
+    for ff in files:
+      for doc_raw in self.fileDocs(ff, wiki):
+        doc_count += 1
+        self.parseDoc(doc_raw)
+        if doc_count % 1000 == 0:
+          print "Finish parsing", doc_count, "documents!"
+      file_count += 1
+      if wiki and file_count % 100 == 0:
+        print "Finish parsing", file_count, "files or ", doc_count, "documents!"
+    return doc_count
 
 
   def parseCorpus20news(self):
 
     print "Loading vocab"
     self.loadVocab()
-    
-    doc_count = 0
 
     print "Parsing corpus"
-    data_folders = [self._corpus_dir + "/train", self._corpus_dir + "/test"]
-    print data_folders
-    for data_folder in data_folders:
-      for folder in glob("%s/*^tgz" % data_folder):
-        for ff in glob("%s/*" % folder):
-          doc_count += 1
-          infile = open(ff, 'r')
-          doc_raw = ""
-          for line in infile:
-            line = line.strip().lower()
-            doc_raw += " " + line
-          self.parseDoc(doc_raw)
-          infile.close()
-          if doc_count % 1000 == 0:
-            print "Finish parsing", doc_count, "documents!"
+    doc_count = self.parseFiles(self.files20news(), False)
 
     self._doc_num = doc_count
     print "Total number of docunments: ", doc_count
@@ -114,29 +186,9 @@ class corpusParser():
 
     print "Loading vocab"
     self.loadVocab()
-    
-    doc_count = 0
 
     print "Parsing corpus"
-
-    years = ["1987", "1988", "1989", "1990", "1991", "1992", "1993", "1994", "1995", "1996"]
-    print data_folders
-
-    for year in years:
-      folder_year = self._corpus_dir + "/" + year
-      for month in glob("%s/[0-9][0-9]" % folder_year):
-        for day in glob("%s" % month):
-          for ff in glob("%s/*" % day):
-            doc_count += 1
-            infile = open(ff, 'r')
-            doc_raw = ""
-            for line in infile:
-              line = line.strip().lower()
-              doc_raw += " " + line
-            self.parseDoc(doc_raw)
-            infile.close()
-            if doc_count % 1000 == 0:
-              print "Finish parsing", doc_count, "documents!"
+    doc_count = self.parseFiles(self.filesNyt(), False)
 
     self._doc_num = doc_count
     print "Total number of docunments: ", doc_count
@@ -149,54 +201,98 @@ class corpusParser():
     self.loadVocab()
 
     print "Parsing corpus"
+    doc_count = self.parseFiles(self.filesWiki(), True)
+
+    self._doc_num = doc_count
+    print "Total number of docunments: ", doc_count
+    self.writeResult()
+
+
+  def parseCorpusParallel(self, option, num_workers, num_shards, part_dir):
+    """
+    Split the files of a corpus into shards that are counted by a pool of
+    worker processes, each writing the counts of its shard to part_dir.
+    Shards that already have a part file are not counted again, so an
+    interrupted run picks up where it left off when started with the same
+    options.  The parts are then added up in shard order.
+    """
+    print "Loading vocab"
+    self.loadVocab()
+
+    files = sorted(self.corpusFiles(option))
+    if num_shards <= 0:
+      num_shards = SHARDS_PER_WORKER * num_workers
+    num_shards = max(1, min(num_shards, len(files)))
+
+    if not os.path.exists(part_dir):
+      os.makedirs(part_dir)
+
+    # Parts are only valid for the same files, shards, window and vocab
+    signature = md5("\n".join(files + [str(num_shards),
+                                       str(self._window_size),
+                                       self._vocab_dir])).hexdigest()
+    manifest = part_dir + "/manifest"
+    if os.path.exists(manifest):
+      assert open(manifest).read().strip() == signature, \
+          "%s holds parts of a different run" % part_dir
+    else:
+      outfile = open(manifest, 'w')
+      outfile.write(signature + "\n")
+      outfile.close()
+
+    jobs = []
+    for ii in xrange(num_shards):
+      if not os.path.exists(part_filename(part_dir, ii)):
+        jobs.append((self._vocab_dir, self._window_size, option == 1,
+                     files[ii::num_shards], part_filename(part_dir, ii),
+                     self._stem_cache, ii))
+    print "Parsing corpus:", len(files), "files in", num_shards, "shards,", \
+        num_shards - len(jobs), "already done"
+
+    pool = Pool(num_workers)
+    done = num_shards - len(jobs)
+    for shard, num_docs, stems in pool.imap_unordered(count_shard, jobs):
+      done += 1
+      # so that saveStemCache keeps the stems the workers found
+      self.addStems(stems)
+      print "Finished shard", shard, "(%i documents)," % num_docs, done, \
+          "of", num_shards, "shards done"
+    pool.close()
+    pool.join()
+
+    print "Merging shards"
     doc_count = 0
-    file_count = 0
-    for folder in glob("%s/*" % self._corpus_dir):
-      for ff in glob("%s/*" % folder):
-        infile = open(ff, 'r')
-        file_count += 1
-        if file_count % 100 == 0:
-          print "Finish parsing", file_count, "files or ", doc_count, "documents!"
-
-        for line in infile:
-          line = line.strip().lower()
-
-          if line.startswith("<doc"):
-            doc_count += 1
-            doc_flag = True
-            doc_raw = ""
-          elif line.startswith("</doc>"):
-            doc_flag = False
-            ### processing doc
-            self.parseDoc(doc_raw)
-          else:
-            assert doc_flag == True
-            doc_raw += " " + line
-        infile.close()
+    for ii in xrange(num_shards):
+      doc_count += self._counter.merge(part_filename(part_dir, ii))
 
     self._doc_num = doc_count
     print "Total number of docunments: ", doc_count
+    print "writing results!"
     self.writeResult()
 
 
   def writeResult(self):
-    # write wordcount
-    outputfile = self._output_dir + "/wordcount.txt"
-    outfile = open(outputfile, 'w')
-    for word in self._wordcount.keys():
-      tmp = word + "\t" + str(self._wordcount[word]) + "\n"
-      outfile.write(tmp)
-    outfile.close()
-
-    # write coccurance:
-    outputfile = self._output_dir + "/cooccurance.txt"
-    outfile = open(outputfile, 'w')
-    for w1 in self._cooccur.keys():
-      for w2 in self._cooccur[w1].keys():
-        if self._cooccur[w1][w2] != 0:
-          tmp = w1 + "\t" + w2 + "\t" + str(self._cooccur[w1][w2]) + "\n"
-          outfile.write(tmp)
-    outfile.close()
+    # write wordcount and coccurance
+    self._counter.write_text(self._output_dir)
+
+
+  def saveCounts(self, filename, num_docs):
+    # write the counts of a shard for parseCorpusParallel to merge
+    self._counter.save(filename, num_docs)
+
+
+  def newStems(self):
+    return self._stemmer.new_stems()
+
+
+  def addStems(self, stems):
+    self._stemmer.add_stems(stems)
+
+
+  def saveStemCache(self):
+    self._stemmer.print_cache_stats()
+    if self._stem_cache:
+      self._stemmer.save_cache(self._stem_cache)
 
 
 flags.define_string("corpus", None, "Where we find the input corpora")
@@ -205,13 +301,29 @@ flags.define_string("vocab", "", "The model files folder of topic models")
 flags.define_int("window_size", 10, "Size of window for computing coocurrance")
 flags.define_string("output", "PMI_stat/20_news", "PMI stat output filename")
 flags.define_int("option", "2", "0: 20_news; 1: wikipedia")
+flags.define_string("stem_cache", None, "File to keep stems in between runs")
+flags.define_int("num_workers", 1,
+                 "Processes counting shards of the corpus (1 counts serially)")
+flags.define_int("num_shards", 0,
+                 "Number of shards (0 for %i per worker)" % SHARDS_PER_WORKER)
+flags.define_string("part_dir", None,
+                    "Where shards write their counts; rerun with the same "
+                    "options to resume (defaults to output/parts)")
 
 if __name__ == "__main__":
   flags.InitFlags()
   # {0: 'english', 1: 'german'}
   lang = 0
-  cp = corpusParser(lang, flags.vocab, flags.corpus, flags.window_size, flags.output)
-  if flags.option == 0:
+  cp = corpusParser(lang, flags.vocab, flags.corpus, flags.window_size,
+                    flags.output, flags.stem_cache)
+  if flags.num_workers > 1:
+    part_dir = flags.part_dir
+    if part_dir is None:
+      part_dir = flags.output + "/parts"
+    cp.parseCorpusParallel(flags.option, flags.num_workers, flags.num_shards,
+                           part_dir)
+    get_tfidf(flags.proto_corpus, flags.vocab, flags.output)
+  elif flags.option == 0:
     cp.parseCorpus20news()
     get_tfidf(flags.proto_corpus, flags.vocab, flags.output)
   elif flags.option == 1:
@@ -221,3 +333,9 @@ if __name__ == "__main__":
     cp.parseCorpusNyt()
     get_tfidf(flags.proto_corpus, flags.vocab, flags.output)
 
+  # Binary copy of the statistics for readStatistics
+  if os.path.exists(flags.output + "/cooccurance.txt"):
+    write_statistics_store(flags.output)
+
+  cp.saveStemCache()
+
@@ -8,6 +8,8 @@ from topicmod.util import flags
 from topicmod.util.sets import write_pickle, read_pickle
 from topicmod.corpora.proto.corpus_pb2 import *
 from topicmod.corpora.proto.wordnet_file_pb2 import *
+from topicmod.corpora.proto_corpus import read_section, latest_vocab, \
+    section_documents
 
 # Faster version of resume_topics_update.py
 # clear_doc_topics.py can only perform doc strategy
@@ -105,30 +107,19 @@ def get_constraints(cons_files):
 def build_index(corpus_dir, maps_file):
   index = defaultdict()
 
+  # the newest vocab also has the terms of sections added by an append
+  vocab = {}
+  for lang in latest_vocab(corpus_dir).tokens:
+    for term in lang.terms:
+      vocab[term.id] = term.original
+      index[term.original] = defaultdict(set)
+
   num_docs = 0
-  read_voc = 0
   for ii in glob("%s/*.index" % corpus_dir):
-    inputfile = open(ii, 'rb')
-    protocorpus = Corpus()
-    protocorpus.ParseFromString(inputfile.read())
-
-    if read_voc == 0:
-      # assume that vocab in each index file is the same, so
-      # we just need to load it once and initialize index once
-      # or it is too slow
-      read_voc = 1
-      vocab = {}
-      for lang in protocorpus.tokens:
-        for ii in lang.terms:
-          vocab[ii.id] = ii.original
-          index[ii.original] = defaultdict(set)
-
-    for dd in protocorpus.doc_filenames:
-      num_docs += 1
+    protocorpus = read_section(ii)
 
-      docfile = open("%s/%s" % (corpus_dir, dd), 'rb')
-      doc = Document()
-      doc.ParseFromString(docfile.read())
+    for dd, doc in section_documents(corpus_dir, ii, protocorpus):
+      num_docs += 1
 
       if num_docs % 250 == 0:
         print doc.id, doc.title, len(index), " vocab seen"
@@ -4,35 +4,32 @@ from topicmod.util import flags
 from PMI_statistics import *
 from numpy import *
 from scipy import linalg
+from scipy.sparse.linalg import eigsh
 import random
 
+LANCZOS_MIN_SIZE = 200
 
-def normalizeCut(A, words_list):
-  A = mat(A)
-  col_sum = A.sum(axis=0)
-  col_sum_nsqrt = array(col_sum)
-  col_sum_nsqrt = col_sum_nsqrt ** (-0.5)
-  words_num = len(A)
 
-  D = zeros((words_num, words_num), float)
-  D_nsqrt = zeros((words_num, words_num), float)
+# the second smallest eigenvalue of a symmetric matrix and its eigenvector;
+# big matrices use Lanczos iteration for just the two smallest
+def fiedlerVector(L):
+  if len(L) >= LANCZOS_MIN_SIZE:
+    evalue, evector = eigsh(L, k=2, which='SA')
+  else:
+    evalue, evector = linalg.eigh(L)
+  index = evalue.argsort()[1]
+  return evalue[index], evector[:, index]
 
-  for ii in range(words_num):
-    D[ii, ii] = col_sum[0, ii]
-    D_nsqrt[ii, ii] = col_sum_nsqrt[0, ii]
 
-  A1 = A+D
-  L = D_nsqrt * (D - A1) * D_nsqrt
-  evalue, evector = linalg.eig(L)
-  sorted_index = evalue.argsort()
-  index = sorted_index[1]
-  eval1 = evalue[index]
-  evec1 = evector[0:words_num, index]
+def spectralSplit(A, words_list):
+  A = asarray(A, dtype=float)
+  words_num = len(A)
+  col_sum_nsqrt = A.sum(axis=0) ** (-0.5)
 
-  print "eig values: \n"
-  print evalue
-  print "eig vectors: \n"
-  print evector
+  # L = D^-1/2 (D - (A + D)) D^-1/2 with D the diagonal of column sums,
+  # scaled directly instead of multiplying by diagonal matrices
+  L = -A * col_sum_nsqrt[:, newaxis] * col_sum_nsqrt[newaxis, :]
+  eval1, evec1 = fiedlerVector(L)
 
   evec1_sorted = sort(evec1)
   thresh = (evec1_sorted[words_num-1] - evec1_sorted[0]) / 3
@@ -48,106 +45,89 @@ def normalizeCut(A, words_list):
     elif evec1[ii] <= thresh_low:
       merge2.append(words_list[ii])
 
-  print evec1
+  split_pair = None
+  if merge1 and merge2:
+    split_pair = (merge1[0], merge2[0])
+
+  return eval1, split_pair, merge1, merge2
+
+
+def normalizeCut(A, words_list):
+  [eval1, split_pair, merge1, merge2] = spectralSplit(A, words_list)
+
   print words_list
-  print thresh_low, thresh_high
   print merge1, merge2
-  
-  split_pair = (merge1[0], merge2[0])
 
   return split_pair, merge1, merge2
 
-def split_a_topic(cooccur, cooccur_total, tfidf, tfidf_thresh, topics, wordcount, wordcount_total):
-
-  minimum = 100000
-  split_topic = -1
-
-  for tt in topics.keys():
-
-    #tmp_words = set(topics[tt].keys())
-    tmp_words = topics[tt]
-
-    # Generate cannot links
-    # If two words with very low cooccur appearing in the same topic
-    # We should add a cannot link
-
-    word_pairs = get_word_pairs(tmp_words, tmp_words)
-    pmi_sum = 0
-    count = 0
-    for (w1, w2) in word_pairs:
-      if tfidf[w1] > tfidf_thresh and tfidf[w2] > tfidf_thresh:
-        pmi = computePMI2(cooccur[w1][w2], cooccur_total, wordcount[w1], wordcount[w2], wordcount_total)
-        count += 1
-        pmi_sum += pmi
-
-    if count > 0:
-      pmi_sum /= count
-      if minimum > pmi_sum:
-        minimum = pmi_sum
-        split_topic = tt
-
-  print "Splitting topic", split_topic
-  assert split_topic != -1
-
-  # split one topic
-  tmp_words = topics[split_topic]
-
-  tmp_list = defaultdict()
-  tmp_list = list(tmp_words)
-  #pmi_array = [0. for x in range(len(tmp_list))]
-  #pmi_array = diag(pmi_array)
-  pmi_array = zeros((len(tmp_list), len(tmp_list)), float)
-  print pmi_array
-
-  for ii in range(len(tmp_list)):
-    for jj in range(ii+1, len(tmp_list)):
-      w1 = tmp_list[ii]
-      w2 = tmp_list[jj]
-      if w1 < w2:
-        pmi = computePMI2(cooccur[w1][w2], cooccur_total, wordcount[w1], wordcount[w2], wordcount_total)
-      else:
-        pmi = computePMI2(cooccur[w2][w1], cooccur_total, wordcount[w1], wordcount[w2], wordcount_total)
-      pmi_array[ii, jj] = pmi
-      pmi_array[jj, ii] = pmi
-      print pmi_array[ii, jj], pmi_array[jj, ii]
-
-  print pmi_array
-
-  # for debug
-  tmp = "["
-  for ii in range(len(tmp_list)):
-    tmp += "["
-    for jj in range(len(tmp_list)):
-      tmp += str(pmi_array[ii, jj]) + ", "
-    tmp += "], "
-  tmp += "]"
-  print tmp
-
-  [split_pair, merge1, merge2] = normalizeCut(pmi_array, tmp_list)
 
-  return split_pair, merge1, merge2
+# words are the topic words in sorted order, and cooccur, tfidf and wordcount
+# are their statistics in that order.  Returns a candidate split of every
+# topic that has one as (mean PMI2, Fiedler eigenvalue, topic, split_pair,
+# merge1, merge2), ordered by the mean PMI2 of the topic.
+def rank_splits(words, cooccur, cooccur_total, tfidf, tfidf_thresh, topics,
+                wordcount, wordcount_total):
+
+  index = dict((x, ii) for ii, x in enumerate(words))
+  pmi = computePMIMatrix(cooccur, cooccur_total, wordcount, wordcount_total,
+                         True)
+  above = tfidf > tfidf_thresh
 
+  splits = []
+  for tt in sorted(topics.keys()):
+    tmp_list = sorted(topics[tt])
+    ids = [index[x] for x in tmp_list]
+    pmi_array = pmi[ix_(ids, ids)]
 
-def write_links(split_pair, merge1, merge2, output_dir):
+    # mean PMI2 of the pairs whose words both pass the tfidf threshold
+    mask = triu(outer(above[ids], above[ids]), 1)
+    count = mask.sum()
+    if count == 0:
+      continue
+    pmi_mean = pmi_array[mask].sum() / count
+
+    [eval1, split_pair, merge1, merge2] = spectralSplit(pmi_array, tmp_list)
+    if split_pair is None:
+      continue
+    splits.append((pmi_mean, eval1, tt, split_pair, merge1, merge2))
+
+  splits.sort()
+  return splits
+
+
+# split the topic with the lowest mean PMI2
+def split_a_topic(words, cooccur, cooccur_total, tfidf, tfidf_thresh, topics,
+                  wordcount, wordcount_total):
+
+  splits = rank_splits(words, cooccur, cooccur_total, tfidf, tfidf_thresh,
+                       topics, wordcount, wordcount_total)
+  assert splits
+
+  print "Splitting topic", splits[0][2]
+  return splits[0][3:]
+
+
+def write_links(splits, output_dir):
 
   print "Generating the links!"
   output_file = open(output_dir, 'w')
 
-  (w1, w2) = split_pair
-  tmp = 'SPLIT_\t' + w1 + '\t' + w2 + '\n'
-  output_file.write(tmp)
+  for split_pair, merge1, merge2 in splits:
+    (w1, w2) = split_pair
+    tmp = 'SPLIT_\t' + w1 + '\t' + w2 + '\n'
+    output_file.write(tmp)
 
-  tmp = 'MERGE_'
-  for word in merge1:
-    tmp += '\t' + word
-  tmp += '\n'
-  output_file.write(tmp)
+    tmp = 'MERGE_'
+    for word in merge1:
+      tmp += '\t' + word
+    tmp += '\n'
+    output_file.write(tmp)
 
-  tmp = 'MERGE_'
-  for word in merge2:
-    tmp += '\t' + word
-  tmp += '\n'
-  output_file.write(tmp)
+    tmp = 'MERGE_'
+    for word in merge2:
+      tmp += '\t' + word
+    tmp += '\n'
+    output_file.write(tmp)
 
   output_file.close()
 
@@ -158,6 +138,9 @@ flags.define_string("model", "", "The model files folder of topic models")
 flags.define_string("output", "constraints/tmp", "Output filename")
 flags.define_int("topics_cutoff", 30, "Number of topic words")
 flags.define_float("tfidf_thresh", 0, "threshold for tfidf")
+flags.define_int("num_splits", 1, "Number of topics to split")
+flags.define_string("rank_by", "pmi", "Which topics to split first: lowest "
+                    "mean PMI2 (pmi) or cleanest normalized cut (cut)")
 
 if __name__ == "__main__":
 
@@ -178,13 +161,21 @@ if __name__ == "__main__":
   [topics, topic_word_set] = readTopics(flags.model, flags.topics_cutoff)
 
   print "Reading statistics"
+  words = sorted(topic_word_set)
   [cooccur, cooccur_total, tfidf, wordcount, wordcount_total] \
-                           = readStatistics(flags.stats, topic_word_set, vocab_size)
+                           = readStatisticsMatrix(flags.stats, words, vocab_size)
 
   print "Generating the links"
-  [split_pair, merge1, merge2] = split_a_topic(cooccur, cooccur_total, tfidf, \
-                        flags.tfidf_thresh, topics, wordcount, wordcount_total)
+  splits = rank_splits(words, cooccur, cooccur_total, tfidf, \
+                       flags.tfidf_thresh, topics, wordcount, wordcount_total)
+  assert splits
+  if flags.rank_by == "cut":
+    splits.sort(key=lambda x: x[1])
+
+  for pmi_mean, eval1, tt, split_pair, merge1, merge2 in splits:
+    print "Topic", tt, "PMI2", pmi_mean, "cut", eval1, split_pair
+  print "Splitting topics", [x[2] for x in splits[:flags.num_splits]]
 
   print "Writing links to file"
-  write_links(split_pair, merge1, merge2, flags.output)
+  write_links([x[3:] for x in splits[:flags.num_splits]], flags.output)
 
@@ -0,0 +1,213 @@
+"""
+A binary copy of the statistics written by get_corpus_statistics
+(wordcount.txt, cooccurance.txt and tfidf_*.txt), so that scripts can read
+the counts of a few hundred topic words without parsing every line.
+
+Words get ids in sorted order.  The store keeps, in the statistics
+directory, the sorted words (stats.words), their counts and tf-idf
+statistics as NumPy arrays, the co-occurrence counts as an upper-triangular
+CSR matrix (stats.indptr, stats.indices and stats.counts) and the totals
+(stats.totals, written last).  The arrays are opened with mmap, so only the
+rows that are asked for are read from disk.
+"""
+
+import os
+from bisect import bisect_left
+
+import numpy
+from scipy.sparse import coo_matrix
+
+STORE_PREFIX = "stats."
+TFIDF_KINDS = ["max", "mean", "mid"]
+CHUNK_SIZE = 1000000
+
+
+def store_filename(input_dir, name):
+  return "%s/%s%s" % (input_dir, STORE_PREFIX, name)
+
+
+def has_statistics_store(input_dir):
+  """
+  Whether there is a complete store that is at least as new as the text
+  files
+  """
+  totals = store_filename(input_dir, "totals")
+  if not os.path.exists(totals):
+    return False
+  text = input_dir + "/cooccurance.txt"
+  return not os.path.exists(text) or \
+      os.path.getmtime(totals) >= os.path.getmtime(text)
+
+
+def statistics_version(input_dir):
+  """
+  A string that changes whenever the statistics readStatistics would read
+  from a directory change (the sizes and modification times of the files)
+  """
+  if has_statistics_store(input_dir):
+    filenames = [store_filename(input_dir, "totals")]
+  else:
+    filenames = [input_dir + "/" + x for x in
+                 ["wordcount.txt", "cooccurance.txt", "tfidf_max.txt"]]
+
+  version = []
+  for ii in filenames:
+    if os.path.exists(ii):
+      stat = os.stat(ii)
+      version.append("%i:%i" % (stat.st_size, int(stat.st_mtime)))
+    else:
+      version.append("-")
+  return ",".join(version)
+
+
+def write_statistics_store(input_dir):
+  """
+  Convert the text statistics in a directory into a store
+  """
+  words = []
+  counts = []
+  for line in open(input_dir + "/wordcount.txt"):
+    word, count = line.rstrip("\n").split("\t")
+    words.append(word)
+    counts.append(int(count))
+  wordcount_total = sum(counts)
+
+  order = sorted(xrange(len(words)), key=lambda x: words[x])
+  words = [words[x] for x in order]
+  ids = dict((x, ii) for ii, x in enumerate(words))
+  wordcount = numpy.array([counts[x] for x in order], dtype=numpy.int64)
+
+  # Read the pairs in chunks so they are never all Python objects at once
+  cooccur_total = 0
+  rows, cols, values = [], [], []
+  chunk = ([], [], [])
+  for line in open(input_dir + "/cooccurance.txt"):
+    w1, w2, count = line.rstrip("\n").split("\t")
+    count = int(count)
+    cooccur_total += count
+    if w1 in ids and w2 in ids:
+      chunk[0].append(min(ids[w1], ids[w2]))
+      chunk[1].append(max(ids[w1], ids[w2]))
+      chunk[2].append(count)
+      if len(chunk[0]) >= CHUNK_SIZE:
+        rows.append(numpy.array(chunk[0], dtype=numpy.int32))
+        cols.append(numpy.array(chunk[1], dtype=numpy.int32))
+        values.append(numpy.array(chunk[2], dtype=numpy.int64))
+        chunk = ([], [], [])
+  rows.append(numpy.array(chunk[0], dtype=numpy.int32))
+  cols.append(numpy.array(chunk[1], dtype=numpy.int32))
+  values.append(numpy.array(chunk[2], dtype=numpy.int64))
+
+  size = len(words)
+  cooccur = coo_matrix((numpy.concatenate(values),
+                        (numpy.concatenate(rows), numpy.concatenate(cols))),
+                       shape=(size, size)).tocsr()
+  cooccur.sum_duplicates()
+  cooccur.sort_indices()
+
+  outfile = open(store_filename(input_dir, "words"), 'w')
+  for ii in words:
+    outfile.write(ii + "\n")
+  outfile.close()
+
+  numpy.save(store_filename(input_dir, "wordcount.npy"), wordcount)
+  numpy.save(store_filename(input_dir, "indptr.npy"),
+             cooccur.indptr.astype(numpy.int64))
+  numpy.save(store_filename(input_dir, "indices.npy"),
+             cooccur.indices.astype(numpy.int32))
+  numpy.save(store_filename(input_dir, "counts.npy"),
+             cooccur.data.astype(numpy.int64))
+
+  for kind in TFIDF_KINDS:
+    tfidf = numpy.zeros(size)
+    filename = "%s/tfidf_%s.txt" % (input_dir, kind)
+    if os.path.exists(filename):
+      for line in open(filename):
+        word, value = line.rstrip("\n").split("\t")
+        if word in ids:
+          tfidf[ids[word]] = float(value)
+    numpy.save(store_filename(input_dir, "tfidf_%s.npy" % kind), tfidf)
+
+  outfile = open(store_filename(input_dir, "totals"), 'w')
+  outfile.write("%i\t%i\n" % (wordcount_total, cooccur_total))
+  outfile.close()
+
+  print "Stored", size, "words and", cooccur.nnz, "pairs in", input_dir
+
+
+class StatisticsStore:
+
+  def __init__(self, input_dir):
+    self._words = [x.rstrip("\n") for x in
+                   open(store_filename(input_dir, "words"))]
+    self._wordcount = self.load(input_dir, "wordcount.npy")
+    self._indptr = self.load(input_dir, "indptr.npy")
+    self._indices = self.load(input_dir, "indices.npy")
+    self._counts = self.load(input_dir, "counts.npy")
+    self._tfidf = dict((x, self.load(input_dir, "tfidf_%s.npy" % x))
+                       for x in TFIDF_KINDS)
+
+    totals = open(store_filename(input_dir, "totals")).read().split()
+    self.wordcount_total = int(totals[0])
+    self.cooccur_total = int(totals[1])
+
+  def load(self, input_dir, name):
+    return numpy.load(store_filename(input_dir, name), mmap_mode='r')
+
+  def __len__(self):
+    return len(self._words)
+
+  def word_id(self, word):
+    """
+    The id of a word, -1 if it has no statistics
+    """
+    index = bisect_left(self._words, word)
+    if index < len(self._words) and self._words[index] == word:
+      return index
+    else:
+      return -1
+
+  def word_ids(self, words):
+    return numpy.array([self.word_id(x) for x in words], dtype=numpy.int64)
+
+  def wordcount(self, ids):
+    """
+    The count of each id (0 for -1)
+    """
+    ids = numpy.asarray(ids)
+    counts = numpy.zeros(len(ids), dtype=numpy.int64)
+    known = ids >= 0
+    counts[known] = self._wordcount[ids[known]]
+    return counts
+
+  def tfidf(self, ids, kind="max"):
+    ids = numpy.asarray(ids)
+    values = numpy.zeros(len(ids))
+    known = ids >= 0
+    values[known] = self._tfidf[kind][ids[known]]
+    return values
+
+  def cooccurrence(self, ids):
+    """
+    A dense symmetric matrix of the co-occurrence counts of every pair of
+    ids (0 where an id is -1), reading only the rows of those ids
+    """
+    ids = numpy.asarray(ids)
+    result = numpy.zeros((len(ids), len(ids)), dtype=numpy.int64)
+    known = numpy.flatnonzero(ids >= 0)
+    if len(known) == 0:
+      return result
+
+    order = known[numpy.argsort(ids[known])]
+    sorted_ids = ids[order]
+    for position in order:
+      start, end = self._indptr[ids[position]], self._indptr[ids[position] + 1]
+      cols = self._indices[start:end]
+      if len(cols) == 0:
+        continue
+      found = numpy.minimum(numpy.searchsorted(cols, sorted_ids),
+                            len(cols) - 1)
+      hits = cols[found] == sorted_ids
+      result[position, order[hits]] = self._counts[start + found[hits]]
+
+    return result + result.T